@@ -1,11 +1,19 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import time
 import sys
+import os
+import argparse
+import subprocess
+import threading
+import functools
+import queue
+from array import array
 from collections import defaultdict
 import math
 
+# matplotlib se importa dentro de las funciones de visualización para que
+# los comandos que no dibujan no paguen su tiempo de carga
+
 class PuntoNube:
     """Clase para representar un punto 3D con información adicional"""
     def __init__(self, x, y, z, r=0, g=0, b=0):
@@ -63,6 +71,76 @@ class LectorPCD:
         
         return puntos
     
+    @staticmethod
+    def leer_archivo_pcd_array(ruta_archivo, estricto=False):
+        """
+        Lee un archivo PCD directamente a arrays de NumPy.
+        Devuelve (coordenadas (N, 3), colores (N, 3)). Con estricto los errores
+        de lectura se propagan en lugar de devolver arrays vacíos
+        """
+        vacio = (np.empty((0, 3)), np.empty((0, 3), dtype=np.int64))
+        
+        try:
+            with open(ruta_archivo, 'r') as archivo:
+                # Saltar cabecera
+                linea = archivo.readline()
+                while linea and not linea.startswith('DATA'):
+                    linea = archivo.readline()
+                
+                # Las líneas de metadatos XML (<...>) que añaden algunos exportadores se ignoran
+                datos = np.loadtxt(archivo, dtype=np.float64, ndmin=2, comments=('#', '<'))
+        
+        except FileNotFoundError:
+            if estricto:
+                raise
+            print(f"Error: No se encontró el archivo {ruta_archivo}")
+            return vacio
+        except Exception as e:
+            if estricto:
+                raise
+            print(f"Error al leer el archivo: {e}")
+            return vacio
+        
+        if datos.shape[0] == 0:
+            return vacio
+        if datos.shape[1] < 3:
+            if estricto:
+                raise ValueError(f"{ruta_archivo}: se esperaban al menos 3 columnas (x y z)")
+            return vacio
+        
+        coordenadas = np.ascontiguousarray(datos[:, :3])
+        colores = np.zeros((len(datos), 3), dtype=np.int64)
+        num_colores = min(datos.shape[1] - 3, 3)
+        colores[:, :num_colores] = datos[:, 3:3 + num_colores]
+        return coordenadas, colores
+    
+    @staticmethod
+    def escribir_archivo_pcd(ruta_archivo, coordenadas, colores=None):
+        """
+        Escribe un array (N, 3) de coordenadas en un archivo PCD ASCII
+        """
+        coordenadas = np.asarray(coordenadas, dtype=np.float64).reshape(-1, 3)
+        if colores is None:
+            colores = np.zeros((len(coordenadas), 3), dtype=np.int64)
+        colores = np.asarray(colores).reshape(-1, 3).astype(np.int64)
+        
+        cabecera = (
+            "# .PCD v0.7 - Point Cloud Data file format\n"
+            "VERSION 0.7\n"
+            "FIELDS x y z r g b\n"
+            "SIZE 4 4 4 1 1 1\n"
+            "TYPE F F F I I I\n"
+            "COUNT 1 1 1 1 1 1\n"
+            f"WIDTH {len(coordenadas)}\n"
+            "HEIGHT 1\n"
+            "VIEWPOINT 0 0 0 1 0 0 0\n"
+            f"POINTS {len(coordenadas)}\n"
+            "DATA ascii"
+        )
+        datos = np.hstack([coordenadas, colores])
+        np.savetxt(ruta_archivo, datos, fmt=['%.3f'] * 3 + ['%d'] * 3,
+                   header=cabecera, comments='')
+    
     @staticmethod
     def generar_datos_sinteticos(num_puntos=10000, rango=10.0):
         """
@@ -83,22 +161,371 @@ class LectorPCD:
             puntos.append(PuntoNube(x, y, z, r, g, b))
         
         return puntos
+    
+    @staticmethod
+    def puntos_a_array(puntos):
+        """
+        Convierte una lista de puntos en un array (N, 3) de coordenadas
+        """
+        if len(puntos) == 0:
+            return np.empty((0, 3))
+        return np.array([(p.x, p.y, p.z) for p in puntos], dtype=np.float64)
 
-class Celda:
-    """Clase para representar una celda en la rejilla de ocupación"""
-    def __init__(self):
+# Desplazamiento y máscara para empaquetar índices (i, j, k) en un entero de 64 bits
+_BITS_CLAVE = 21
+_DESPLAZAMIENTO_CLAVE = 1 << (_BITS_CLAVE - 1)
+_MASCARA_CLAVE = (1 << _BITS_CLAVE) - 1
+
+def _codificar_claves(indices, consulta=False):
+    """
+    Empaqueta un array (N, 3) de índices de celda en claves int64 ordenables.
+    Cada índice debe estar en [-2^20, 2^20); fuera de ese rango lanza ValueError
+    o, si consulta es True, devuelve la clave -1, que nunca está almacenada
+    """
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    fuera = np.any((indices < -_DESPLAZAMIENTO_CLAVE) | (indices >= _DESPLAZAMIENTO_CLAVE), axis=1)
+    if fuera.any() and not consulta:
+        raise ValueError(f"Índice de celda {indices[fuera][0].tolist()} fuera del rango "
+                         f"±{_DESPLAZAMIENTO_CLAVE}; usa celdas mayores o centra la nube")
+    indices = indices + _DESPLAZAMIENTO_CLAVE
+    claves = (indices[:, 0] << (2 * _BITS_CLAVE)) | (indices[:, 1] << _BITS_CLAVE) | indices[:, 2]
+    claves[fuera] = -1
+    return claves
+
+def _decodificar_claves(claves):
+    """Operación inversa de _codificar_claves"""
+    claves = np.asarray(claves, dtype=np.int64)
+    indices = np.empty((len(claves), 3), dtype=np.int64)
+    indices[:, 0] = (claves >> (2 * _BITS_CLAVE)) & _MASCARA_CLAVE
+    indices[:, 1] = (claves >> _BITS_CLAVE) & _MASCARA_CLAVE
+    indices[:, 2] = claves & _MASCARA_CLAVE
+    return indices - _DESPLAZAMIENTO_CLAVE
+
+def _buscar_claves(claves_ordenadas, claves):
+    """
+    Busca claves en un array ordenado. Devuelve la posición de cada una
+    o -1 si no está presente
+    """
+    posiciones = np.full(len(claves), -1, dtype=np.int64)
+    if len(claves_ordenadas) == 0:
+        return posiciones
+    candidatas = np.minimum(np.searchsorted(claves_ordenadas, claves), len(claves_ordenadas) - 1)
+    encontradas = claves_ordenadas[candidatas] == claves
+    posiciones[encontradas] = candidatas[encontradas]
+    return posiciones
+
+def _a_coordenadas(datos):
+    """
+    Obtiene un array (N, 3) a partir de una lista de puntos, un array (o lista
+    de coordenadas) o una estructura con método obtener_coordenadas
+    """
+    if hasattr(datos, 'obtener_coordenadas'):
+        return datos.obtener_coordenadas()
+    if len(datos) > 0 and isinstance(datos[0], PuntoNube):
+        return LectorPCD.puntos_a_array(datos)
+    return np.asarray(datos, dtype=np.float64).reshape(-1, 3)
+
+def _expandir_rangos(comienzos, longitudes):
+    """Concatena los índices de los rangos [comienzo, comienzo + longitud)"""
+    longitudes = np.asarray(longitudes, dtype=np.int64)
+    total = int(longitudes.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    desplazamiento = np.cumsum(longitudes) - longitudes - comienzos
+    return np.arange(total) - np.repeat(desplazamiento, longitudes)
+
+def crear_frustum(posicion, direccion, arriba=(0, 0, 1), fov_vertical=60.0, aspecto=4 / 3,
+                  cerca=0.1, lejos=50.0):
+    """
+    Construye el volumen de visión de una cámara. Devuelve un diccionario con
+    los 6 planos (a, b, c, d) con la normal hacia el interior, de forma que un
+    punto p está dentro si a*x + b*y + c*z + d >= 0 para todos ellos, y los
+    8 vértices del volumen. Si la dirección es paralela a arriba (cámara
+    cenital), se usa como arriba el eje de coordenadas más perpendicular a ella
+    """
+    posicion = np.asarray(posicion, dtype=np.float64)
+    adelante = np.asarray(direccion, dtype=np.float64)
+    if np.linalg.norm(adelante) == 0:
+        raise ValueError("La dirección del frustum no puede ser nula")
+    adelante = adelante / np.linalg.norm(adelante)
+    derecha = np.cross(adelante, arriba)
+    if np.linalg.norm(derecha) < 1e-6 * np.linalg.norm(arriba):
+        derecha = np.cross(adelante, np.eye(3)[np.argmin(np.abs(adelante))])
+    derecha = derecha / np.linalg.norm(derecha)
+    arriba = np.cross(derecha, adelante)
+    
+    vertices = []
+    for distancia in (cerca, lejos):
+        alto = distancia * math.tan(math.radians(fov_vertical) / 2)
+        ancho = alto * aspecto
+        centro = posicion + adelante * distancia
+        for sv, sh in ((-1, -1), (-1, 1), (1, 1), (1, -1)):
+            vertices.append(centro + sv * alto * arriba + sh * ancho * derecha)
+    vertices = np.array(vertices)
+    
+    # Caras definidas por tres vértices en orden tal que la normal apunta hacia dentro
+    caras = [(0, 1, 2), (4, 7, 6), (0, 4, 5), (2, 6, 7), (1, 5, 6), (0, 3, 7)]
+    planos = []
+    interior = vertices.mean(axis=0)
+    for a, b, c in caras:
+        normal = np.cross(vertices[b] - vertices[a], vertices[c] - vertices[a])
+        normal = normal / np.linalg.norm(normal)
+        d = -normal @ vertices[a]
+        if normal @ interior + d < 0:
+            normal, d = -normal, -d
+        planos.append([*normal, d])
+    
+    return {'planos': np.array(planos), 'vertices': vertices}
+
+def _clasificar_cajas(minimos, maximos, region):
+    """
+    Clasifica cajas alineadas con los ejes (K, 3) frente a una región, que puede
+    ser una caja (minimo, maximo) o un frustum. Devuelve 0 si la caja queda
+    fuera, 1 si la corta y 2 si queda completamente dentro
+    """
+    if isinstance(region, dict):
+        planos = region['planos']
+        normales = planos[:, :3]
+        # Vértice más adelantado y más atrasado de cada caja según cada normal
+        positivos = np.where(normales[None] >= 0, maximos[:, None], minimos[:, None])
+        negativos = np.where(normales[None] >= 0, minimos[:, None], maximos[:, None])
+        fuera = np.any(np.einsum('kpi,pi->kp', positivos, normales) + planos[:, 3] < 0, axis=1)
+        dentro = np.all(np.einsum('kpi,pi->kp', negativos, normales) + planos[:, 3] >= 0, axis=1)
+    else:
+        minimo, maximo = region
+        fuera = np.any((maximos < minimo) | (minimos > maximo), axis=1)
+        dentro = np.all((minimos >= minimo) & (maximos <= maximo), axis=1)
+    return np.where(fuera, 0, np.where(dentro, 2, 1))
+
+def _puntos_en_region(coordenadas, region):
+    """Máscara de los puntos contenidos en una caja (minimo, maximo) o un frustum"""
+    if isinstance(region, dict):
+        planos = region['planos']
+        return np.all(coordenadas @ planos[:, :3].T + planos[:, 3] >= 0, axis=1)
+    minimo, maximo = region
+    return np.all((coordenadas >= minimo) & (coordenadas <= maximo), axis=1)
+
+def _limites_region(region):
+    """Caja envolvente (minimo, maximo) de una caja o un frustum"""
+    if isinstance(region, dict):
+        return region['vertices'].min(axis=0), region['vertices'].max(axis=0)
+    return region
+
+def _normalizar_cajas(minimos, maximos):
+    """Convierte una o varias cajas a dos arrays (M, 3)"""
+    minimos = np.asarray(minimos, dtype=np.float64).reshape(-1, 3)
+    maximos = np.asarray(maximos, dtype=np.float64).reshape(-1, 3)
+    if minimos.shape != maximos.shape:
+        raise ValueError("Debe haber el mismo número de mínimos que de máximos")
+    return minimos, maximos
+
+def _covarianza_desde_momentos(num_puntos, suma, suma_productos):
+    """
+    Calcula la covarianza muestral a partir del número de puntos, la suma
+    de coordenadas y la suma de productos exteriores. Admite lotes (..., 3, 3)
+    """
+    num_puntos = np.asarray(num_puntos, dtype=np.float64)[..., None, None]
+    media = np.asarray(suma, dtype=np.float64)[..., :, None] / num_puntos
+    producto_medias = media * np.swapaxes(media, -1, -2)
+    return (suma_productos - num_puntos * producto_medias) / np.maximum(num_puntos - 1, 1)
+
+class ListaPuntosCuantizada:
+    """
+    Almacén compacto de puntos para una celda o nodo de tamaño conocido. Cada
+    coordenada se guarda como un entero sin signo de 8 o 16 bits relativo al
+    origen (esquina mínima) de la celda, y el color como 3 bytes. Se comporta
+    como una lista de PuntoNube: los puntos se decodifican al acceder a ellos
+    """
+    
+    def __init__(self, origen, tamaño, bits=8):
+        if bits not in (8, 16):
+            raise ValueError(f"Bits de cuantización no soportados: {bits}")
+        self.origen = np.asarray(origen, dtype=np.float64)
+        self._origen_lista = self.origen.tolist()
+        self.tamaño = tamaño
+        self.bits = bits
+        self.maximo_codigo = (1 << bits) - 1
+        self.paso = tamaño / self.maximo_codigo
+        self.codigos = array('B' if bits == 8 else 'H')
+        self.colores = array('B')
+    
+    def _codificar(self, coordenadas):
+        """Convierte coordenadas (N, 3) en códigos enteros"""
+        codigos = np.rint((coordenadas - self.origen) / self.paso)
+        return np.clip(codigos, 0, self.maximo_codigo).astype(np.uint8 if self.bits == 8 else np.uint16)
+    
+    def append(self, punto):
+        """Codifica y agrega un punto"""
+        ox, oy, oz = self._origen_lista
+        inverso, maximo = 1.0 / self.paso, self.maximo_codigo
+        qx = int((punto.x - ox) * inverso + 0.5)
+        qy = int((punto.y - oy) * inverso + 0.5)
+        qz = int((punto.z - oz) * inverso + 0.5)
+        self.codigos.extend((min(max(qx, 0), maximo), min(max(qy, 0), maximo), min(max(qz, 0), maximo)))
+        self.colores.extend((min(max(int(punto.r), 0), 255), min(max(int(punto.g), 0), 255),
+                             min(max(int(punto.b), 0), 255)))
+    
+    def extender_array(self, coordenadas, colores=None):
+        """Codifica y agrega un array (N, 3) de coordenadas de una vez"""
+        coordenadas = np.asarray(coordenadas, dtype=np.float64).reshape(-1, 3)
+        if colores is None:
+            colores = np.zeros((len(coordenadas), 3))
+        self.codigos.frombytes(self._codificar(coordenadas).tobytes())
+        self.colores.frombytes(np.clip(colores, 0, 255).astype(np.uint8).tobytes())
+    
+    def a_array(self):
+        """Decodifica todas las coordenadas como array (N, 3)"""
+        codigos = np.frombuffer(self.codigos, dtype=np.uint8 if self.bits == 8 else np.uint16)
+        return codigos.reshape(-1, 3) * self.paso + self.origen
+    
+    def _decodificar(self, i):
+        """Construye el PuntoNube de la posición i"""
+        x, y, z = (self.codigos[3 * i + a] * self.paso + self._origen_lista[a] for a in range(3))
+        r, g, b = self.colores[3 * i:3 * i + 3]
+        return PuntoNube(x, y, z, r, g, b)
+    
+    def __len__(self):
+        return len(self.codigos) // 3
+    
+    def __iter__(self):
+        return (self._decodificar(i) for i in range(len(self)))
+    
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self._decodificar(i) for i in range(*indice.indices(len(self)))]
+        if indice < 0:
+            indice += len(self)
+        if not 0 <= indice < len(self):
+            raise IndexError("Índice de punto fuera de rango")
+        return self._decodificar(indice)
+    
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.codigos) + sys.getsizeof(self.colores)
+    
+    def error_maximo(self):
+        """Cota del error de cuantización por eje (medio paso)"""
+        return self.paso / 2
+    
+    def memoria_sin_cuantizar(self):
+        """Memoria estimada de los mismos puntos guardados como lista de PuntoNube"""
+        return sys.getsizeof([]) + len(self) * (8 + sys.getsizeof(PuntoNube(0.0, 0.0, 0.0)))
+
+def _memoria_puntos(puntos):
+    """Memoria aproximada de los puntos de una celda o nodo"""
+    if isinstance(puntos, ListaPuntosCuantizada):
+        return sys.getsizeof(puntos)
+    return sys.getsizeof(puntos) + sum(sys.getsizeof(p) for p in puntos)
+
+class _ConsultasEspaciales:
+    """
+    Consultas por caja y por volumen de visión comunes a RejillaOcupacion y
+    Octree. Cada estructura implementa _consulta_region(region, devolver)
+    """
+    
+    def consulta_cajas(self, minimos, maximos, devolver='indices'):
+        """
+        Consulta varias cajas alineadas con los ejes. minimos y maximos son arrays
+        (M, 3). Devuelve una lista con, para cada caja, los índices de los puntos
+        contenidos (en obtener_coordenadas) o sus coordenadas
+        """
+        minimos, maximos = _normalizar_cajas(minimos, maximos)
+        return [self._consulta_region((minimo, maximo), devolver)
+                for minimo, maximo in zip(minimos, maximos)]
+    
+    def consulta_caja(self, minimo, maximo, devolver='indices'):
+        """Consulta una única caja alineada con los ejes"""
+        return self.consulta_cajas(minimo, maximo, devolver)[0]
+    
+    def consulta_frustum(self, frustum, devolver='indices'):
+        """Devuelve los puntos dentro de un volumen de visión creado con crear_frustum"""
+        return self._consulta_region(frustum, devolver)
+
+class _EstadisticasPuntos:
+    """
+    Estadísticas acumuladas de los puntos de una celda o nodo: suma de
+    coordenadas, segundos momentos y caja envolvente
+    """
+    
+    def _iniciar_estadisticas(self):
+        """Pone a cero las estadísticas"""
         self.num_puntos = 0
         self.suma_x = 0.0
         self.suma_y = 0.0
         self.suma_z = 0.0
-        self.puntos = []
+        # Suma de productos exteriores (segundos momentos) para la covarianza
+        self.suma_xx = 0.0
+        self.suma_yy = 0.0
+        self.suma_zz = 0.0
+        self.suma_xy = 0.0
+        self.suma_xz = 0.0
+        self.suma_yz = 0.0
+        # Caja envolvente de los puntos (usada por los mapas de elevación)
+        self.min_x = self.min_y = self.min_z = float('inf')
+        self.max_x = self.max_y = self.max_z = float('-inf')
     
-    def agregar_punto(self, punto):
-        """Agrega un punto a la celda"""
+    def _acumular_punto(self, punto):
+        """Actualiza las estadísticas con un punto"""
         self.num_puntos += 1
         self.suma_x += punto.x
         self.suma_y += punto.y
         self.suma_z += punto.z
+        self.suma_xx += punto.x * punto.x
+        self.suma_yy += punto.y * punto.y
+        self.suma_zz += punto.z * punto.z
+        self.suma_xy += punto.x * punto.y
+        self.suma_xz += punto.x * punto.z
+        self.suma_yz += punto.y * punto.z
+        self.min_x = min(self.min_x, punto.x)
+        self.max_x = max(self.max_x, punto.x)
+        self.min_y = min(self.min_y, punto.y)
+        self.max_y = max(self.max_y, punto.y)
+        self.min_z = min(self.min_z, punto.z)
+        self.max_z = max(self.max_z, punto.z)
+    
+    def agregar_momentos(self, num_puntos, suma, suma_productos, minimo, maximo):
+        """Acumula estadísticas precalculadas de un lote de puntos"""
+        self.num_puntos += int(num_puntos)
+        self.suma_x += suma[0]
+        self.suma_y += suma[1]
+        self.suma_z += suma[2]
+        self.suma_xx += suma_productos[0][0]
+        self.suma_yy += suma_productos[1][1]
+        self.suma_zz += suma_productos[2][2]
+        self.suma_xy += suma_productos[0][1]
+        self.suma_xz += suma_productos[0][2]
+        self.suma_yz += suma_productos[1][2]
+        self.min_x = min(self.min_x, float(minimo[0]))
+        self.max_x = max(self.max_x, float(maximo[0]))
+        self.min_y = min(self.min_y, float(minimo[1]))
+        self.max_y = max(self.max_y, float(maximo[1]))
+        self.min_z = min(self.min_z, float(minimo[2]))
+        self.max_z = max(self.max_z, float(maximo[2]))
+    
+    def obtener_momentos(self):
+        """Devuelve la suma de coordenadas y la matriz 3x3 de segundos momentos"""
+        suma = np.array([self.suma_x, self.suma_y, self.suma_z])
+        suma_productos = np.array([[self.suma_xx, self.suma_xy, self.suma_xz],
+                                   [self.suma_xy, self.suma_yy, self.suma_yz],
+                                   [self.suma_xz, self.suma_yz, self.suma_zz]])
+        return suma, suma_productos
+    
+    def obtener_covarianza(self):
+        """Calcula la matriz de covarianza 3x3 de los puntos"""
+        if self.num_puntos < 2:
+            return None
+        suma, suma_productos = self.obtener_momentos()
+        return _covarianza_desde_momentos(self.num_puntos, suma, suma_productos)
+
+class Celda(_EstadisticasPuntos):
+    """Clase para representar una celda en la rejilla de ocupación"""
+    def __init__(self, puntos=None):
+        self._iniciar_estadisticas()
+        # Lista de puntos o almacén cuantizado (ListaPuntosCuantizada)
+        self.puntos = [] if puntos is None else puntos
+    
+    def agregar_punto(self, punto):
+        """Agrega un punto a la celda"""
+        self._acumular_punto(punto)
         self.puntos.append(punto)
     
     def obtener_media(self):
@@ -115,16 +542,20 @@ class Celda:
         """Verifica si la celda está ocupada"""
         return self.num_puntos > 0
 
-class RejillaOcupacion:
+class RejillaOcupacion(_ConsultasEspaciales):
     """Implementación de rejilla de ocupación 3D"""
     
-    def __init__(self, tamaño_celda=1.0):
+    def __init__(self, tamaño_celda=1.0, bits_cuantizacion=None):
         self.tamaño_celda = tamaño_celda
+        # Si se indica (8 o 16), los puntos se guardan cuantizados dentro de su celda
+        self.bits_cuantizacion = bits_cuantizacion
         self.celdas = {}
         self.num_puntos_total = 0
         self.limites = {'min_x': float('inf'), 'max_x': float('-inf'),
                        'min_y': float('inf'), 'max_y': float('-inf'),
                        'min_z': float('inf'), 'max_z': float('-inf')}
+        # Arrays derivados de las celdas; se invalidan al agregar puntos
+        self._cache = {}
     
     def _obtener_indices_celda(self, punto):
         """Calcula los índices de celda para un punto dado"""
@@ -133,15 +564,24 @@ class RejillaOcupacion:
         k = int(math.floor(punto.z / self.tamaño_celda))
         return (i, j, k)
     
+    def _crear_celda(self, indices):
+        """Crea una celda vacía con el almacenamiento de puntos configurado"""
+        if self.bits_cuantizacion is None:
+            return Celda()
+        origen = np.array(indices) * self.tamaño_celda
+        return Celda(ListaPuntosCuantizada(origen, self.tamaño_celda, self.bits_cuantizacion))
+    
     def agregar_punto(self, punto):
         """Agrega un punto a la rejilla"""
         indices = self._obtener_indices_celda(punto)
         
         if indices not in self.celdas:
-            self.celdas[indices] = Celda()
+            _codificar_claves([indices])  # Comprueba que la celda es representable
+            self.celdas[indices] = self._crear_celda(indices)
         
         self.celdas[indices].agregar_punto(punto)
         self.num_puntos_total += 1
+        self._cache.clear()
         
         # Actualizar límites
         self.limites['min_x'] = min(self.limites['min_x'], punto.x)
@@ -156,6 +596,416 @@ class RejillaOcupacion:
         for punto in puntos:
             self.agregar_punto(punto)
     
+    def agregar_puntos_array(self, coordenadas, colores=None, guardar_puntos=True):
+        """
+        Agrega un array (N, 3) de coordenadas de forma vectorizada.
+        Las estadísticas de cada celda (conteo, sumas y segundos momentos)
+        se calculan en bloque; si guardar_puntos es False solo se conservan
+        dichas estadísticas y no los puntos individuales
+        """
+        coordenadas = np.asarray(coordenadas, dtype=np.float64).reshape(-1, 3)
+        if len(coordenadas) == 0:
+            return
+        
+        indices = np.floor(coordenadas / self.tamaño_celda).astype(np.int64)
+        claves, primeros, inversa = np.unique(_codificar_claves(indices),
+                                              return_index=True, return_inverse=True)
+        num_celdas = len(claves)
+        
+        conteos = np.bincount(inversa, minlength=num_celdas)
+        sumas = np.stack([np.bincount(inversa, coordenadas[:, a], num_celdas)
+                          for a in range(3)], axis=1)
+        momentos = np.empty((num_celdas, 3, 3))
+        for a in range(3):
+            for b in range(a, 3):
+                momentos[:, a, b] = np.bincount(inversa, coordenadas[:, a] * coordenadas[:, b], num_celdas)
+                momentos[:, b, a] = momentos[:, a, b]
+        minimos_celda = np.full((num_celdas, 3), np.inf)
+        maximos_celda = np.full((num_celdas, 3), -np.inf)
+        np.minimum.at(minimos_celda, inversa, coordenadas)
+        np.maximum.at(maximos_celda, inversa, coordenadas)
+        
+        if guardar_puntos:
+            orden = np.argsort(inversa, kind='stable')
+            inicios = np.concatenate(([0], np.cumsum(conteos)))
+            if colores is None:
+                colores = np.zeros((len(coordenadas), 3), dtype=np.int64)
+            colores = np.asarray(colores).reshape(-1, 3)
+            if self.bits_cuantizacion is None:
+                colores = colores.tolist()
+                lista_coordenadas = coordenadas.tolist()
+        
+        for n, indice_celda in enumerate(map(tuple, indices[primeros].tolist())):
+            if indice_celda not in self.celdas:
+                self.celdas[indice_celda] = self._crear_celda(indice_celda)
+            celda = self.celdas[indice_celda]
+            celda.agregar_momentos(conteos[n], sumas[n], momentos[n], minimos_celda[n], maximos_celda[n])
+            if guardar_puntos and self.bits_cuantizacion is not None:
+                seleccion = orden[inicios[n]:inicios[n + 1]]
+                celda.puntos.extender_array(coordenadas[seleccion], colores[seleccion])
+            elif guardar_puntos:
+                for p in orden[inicios[n]:inicios[n + 1]].tolist():
+                    x, y, z = lista_coordenadas[p]
+                    r, g, b = colores[p]
+                    celda.puntos.append(PuntoNube(x, y, z, r, g, b))
+        
+        self.num_puntos_total += len(coordenadas)
+        
+        # Actualizar límites
+        minimos = coordenadas.min(axis=0)
+        maximos = coordenadas.max(axis=0)
+        for eje, a in zip('xyz', range(3)):
+            self.limites['min_' + eje] = min(self.limites['min_' + eje], float(minimos[a]))
+            self.limites['max_' + eje] = max(self.limites['max_' + eje], float(maximos[a]))
+        
+        self._cache.clear()
+    
+    def _arrays_celdas(self):
+        """
+        Devuelve las estadísticas de las celdas ocupadas como arrays ordenados
+        por clave: claves, índices (i, j, k), conteos, sumas, segundos momentos
+        y caja envolvente de los puntos
+        """
+        if 'celdas' not in self._cache:
+            num_celdas = len(self.celdas)
+            indices = np.array(list(self.celdas.keys()), dtype=np.int64).reshape(-1, 3)
+            conteos = np.empty(num_celdas, dtype=np.int64)
+            sumas = np.empty((num_celdas, 3))
+            momentos = np.empty((num_celdas, 3, 3))
+            minimos = np.empty((num_celdas, 3))
+            maximos = np.empty((num_celdas, 3))
+            for n, celda in enumerate(self.celdas.values()):
+                conteos[n] = celda.num_puntos
+                sumas[n], momentos[n] = celda.obtener_momentos()
+                minimos[n] = celda.min_x, celda.min_y, celda.min_z
+                maximos[n] = celda.max_x, celda.max_y, celda.max_z
+            
+            claves = _codificar_claves(indices)
+            orden = np.argsort(claves)
+            self._cache['celdas'] = {
+                'claves': claves[orden],
+                'indices': indices[orden],
+                'num_puntos': conteos[orden],
+                'sumas': sumas[orden],
+                'momentos': momentos[orden],
+                'minimos': minimos[orden],
+                'maximos': maximos[orden]
+            }
+        return self._cache['celdas']
+    
+    def _preparar_ndt(self, min_puntos, ratio_autovalores):
+        """
+        Calcula la media y la inversa de la covarianza de cada celda con al
+        menos min_puntos puntos. Los autovalores pequeños se elevan hasta
+        ratio_autovalores veces el mayor para evitar matrices singulares
+        """
+        clave_cache = ('ndt', min_puntos, ratio_autovalores)
+        if clave_cache not in self._cache:
+            datos = self._arrays_celdas()
+            validas = datos['num_puntos'] >= max(min_puntos, 3)
+            conteos = datos['num_puntos'][validas]
+            medias = datos['sumas'][validas] / conteos[:, None]
+            covarianzas = _covarianza_desde_momentos(conteos, datos['sumas'][validas],
+                                                     datos['momentos'][validas])
+            
+            autovalores, autovectores = np.linalg.eigh(covarianzas)
+            minimo = autovalores[:, -1:] * ratio_autovalores
+            autovalores = np.maximum(autovalores, np.maximum(minimo, 1e-12))
+            inversas = np.einsum('nij,nj,nkj->nik', autovectores, 1.0 / autovalores, autovectores)
+            
+            self._cache[clave_cache] = {
+                'claves': datos['claves'][validas],
+                'medias': medias,
+                'inversas': inversas
+            }
+        return self._cache[clave_cache]
+    
+    def puntuacion_ndt(self, consultas, min_puntos=5, ratio_autovalores=0.01):
+        """
+        Evalúa la puntuación NDT de N puntos de consulta en una sola llamada.
+        Cada punto recibe exp(-0.5 * d^T C^-1 d), siendo d la distancia a la
+        media de su celda y C la covarianza de la celda. Los puntos que caen en
+        celdas vacías o con pocos puntos reciben 0. Devuelve un array (N,);
+        su suma es la puntuación total del conjunto
+        """
+        consultas = _a_coordenadas(consultas)
+        puntuaciones = np.zeros(len(consultas))
+        
+        datos = self._preparar_ndt(min_puntos, ratio_autovalores)
+        claves = _codificar_claves(np.floor(consultas / self.tamaño_celda).astype(np.int64), consulta=True)
+        posiciones = _buscar_claves(datos['claves'], claves)
+        encontradas = posiciones >= 0
+        posiciones = posiciones[encontradas]
+        
+        diferencias = consultas[encontradas] - datos['medias'][posiciones]
+        mahalanobis = np.einsum('ni,nij,nj->n', diferencias, datos['inversas'][posiciones], diferencias)
+        puntuaciones[encontradas] = np.exp(-0.5 * mahalanobis)
+        return puntuaciones
+    
+    def normales_celdas(self, min_puntos=5):
+        """
+        Estima la normal de la superficie en cada celda como el autovector de
+        menor autovalor de su covarianza. Devuelve (claves ordenadas, normales);
+        las celdas con menos de min_puntos puntos se descartan
+        """
+        clave_cache = ('normales', min_puntos)
+        if clave_cache not in self._cache:
+            datos = self._arrays_celdas()
+            validas = datos['num_puntos'] >= max(min_puntos, 3)
+            covarianzas = _covarianza_desde_momentos(datos['num_puntos'][validas],
+                                                     datos['sumas'][validas],
+                                                     datos['momentos'][validas])
+            _, autovectores = np.linalg.eigh(covarianzas)
+            self._cache[clave_cache] = (datos['claves'][validas], autovectores[:, :, 0])
+        return self._cache[clave_cache]
+    
+    def normales_entorno(self, consultas, min_puntos=5):
+        """
+        Estima la normal en cada consulta a partir de la covarianza de los puntos
+        de su celda y de las 26 vecinas. Devuelve un array (N, 3); las consultas
+        con menos de min_puntos puntos en ese entorno reciben NaN
+        """
+        consultas = _a_coordenadas(consultas)
+        datos = self._arrays_celdas()
+        # Las consultas de una misma celda comparten entorno
+        claves, inversa = np.unique(_codificar_claves(np.floor(consultas / self.tamaño_celda).astype(np.int64),
+                                                      consulta=True), return_inverse=True)
+        indices = _decodificar_claves(claves)
+        # Las consultas fuera del rango de claves (clave -1) no tienen entorno
+        indices[claves < 0] = 2 * _DESPLAZAMIENTO_CLAVE
+        num_puntos = np.zeros(len(claves), dtype=np.int64)
+        sumas = np.zeros((len(claves), 3))
+        momentos = np.zeros((len(claves), 3, 3))
+        rango = (-1, 0, 1)
+        for desplazamiento in [(i, j, k) for i in rango for j in rango for k in rango]:
+            posiciones = _buscar_claves(datos['claves'], _codificar_claves(indices + desplazamiento, consulta=True))
+            presentes = posiciones >= 0
+            num_puntos[presentes] += datos['num_puntos'][posiciones[presentes]]
+            sumas[presentes] += datos['sumas'][posiciones[presentes]]
+            momentos[presentes] += datos['momentos'][posiciones[presentes]]
+        
+        normales = np.full((len(claves), 3), np.nan)
+        validas = num_puntos >= max(min_puntos, 3)
+        if validas.any():
+            covarianzas = _covarianza_desde_momentos(num_puntos[validas], sumas[validas], momentos[validas])
+            normales[validas] = np.linalg.eigh(covarianzas)[1][:, :, 0]
+        return normales[inversa.reshape(-1)]
+    
+    def _arrays_puntos(self):
+        """
+        Devuelve los puntos almacenados como un único array agrupado por celda,
+        en el mismo orden que _arrays_celdas, junto con el rango de cada celda
+        """
+        if 'puntos' not in self._cache:
+            datos = self._arrays_celdas()
+            celdas = [self.celdas[indices] for indices in map(tuple, datos['indices'].tolist())]
+            longitudes = np.array([len(celda.puntos) for celda in celdas], dtype=np.int64)
+            finales = np.cumsum(longitudes)
+            if self.bits_cuantizacion is None:
+                coordenadas = LectorPCD.puntos_a_array([p for celda in celdas for p in celda.puntos])
+            else:
+                coordenadas = np.concatenate([np.empty((0, 3))] + [celda.puntos.a_array() for celda in celdas])
+            self._cache['puntos'] = {
+                'coordenadas': coordenadas,
+                'inicios': finales - longitudes,
+                'finales': finales
+            }
+        return self._cache['puntos']
+    
+    def obtener_coordenadas(self):
+        """
+        Devuelve las coordenadas de los puntos almacenados como array (N, 3).
+        Los índices que devuelven las consultas espaciales se refieren a este array
+        """
+        return self._arrays_puntos()['coordenadas']
+    
+    def medias_celdas(self):
+        """Devuelve la media de los puntos de cada celda ocupada como array (N, 3)"""
+        datos = self._arrays_celdas()
+        return datos['sumas'] / datos['num_puntos'][:, None]
+    
+    def _celdas_en_caja(self, minimo, maximo):
+        """
+        Posiciones (en _arrays_celdas) de las celdas ocupadas que cortan la caja.
+        Enumera las claves de la caja o filtra las claves ocupadas, según qué
+        conjunto sea más pequeño
+        """
+        datos = self._arrays_celdas()
+        if len(datos['claves']) == 0:
+            return np.empty(0, dtype=np.int64)
+        
+        # Recortar la caja a los límites de la rejilla
+        minimo = np.maximum(minimo, [self.limites['min_x'], self.limites['min_y'], self.limites['min_z']])
+        maximo = np.minimum(maximo, [self.limites['max_x'], self.limites['max_y'], self.limites['max_z']])
+        if np.any(minimo > maximo):
+            return np.empty(0, dtype=np.int64)
+        
+        indice_min = np.floor(minimo / self.tamaño_celda).astype(np.int64)
+        indice_max = np.floor(maximo / self.tamaño_celda).astype(np.int64)
+        num_claves_caja = int(np.prod(indice_max - indice_min + 1))
+        
+        if num_claves_caja <= len(datos['claves']):
+            rangos = [np.arange(indice_min[a], indice_max[a] + 1) for a in range(3)]
+            malla = np.stack(np.meshgrid(*rangos, indexing='ij'), axis=-1).reshape(-1, 3)
+            posiciones = _buscar_claves(datos['claves'], _codificar_claves(malla, consulta=True))
+            return posiciones[posiciones >= 0]
+        
+        indices = datos['indices']
+        return np.flatnonzero(np.all((indices >= indice_min) & (indices <= indice_max), axis=1))
+    
+    def _consulta_region(self, region, devolver):
+        """Puntos de las celdas que cortan una caja o un frustum"""
+        minimo, maximo = _limites_region(region)
+        posiciones = self._celdas_en_caja(minimo, maximo)
+        indices_celda = self._arrays_celdas()['indices'][posiciones]
+        clases = _clasificar_cajas(indices_celda * self.tamaño_celda,
+                                   (indices_celda + 1) * self.tamaño_celda, region)
+        
+        puntos = self._arrays_puntos()
+        inicios = puntos['inicios'][posiciones]
+        longitudes = puntos['finales'][posiciones] - inicios
+        
+        # Celdas interiores completas y, de las del borde, solo los puntos dentro
+        interiores = _expandir_rangos(inicios[clases == 2], longitudes[clases == 2])
+        borde = _expandir_rangos(inicios[clases == 1], longitudes[clases == 1])
+        borde = borde[_puntos_en_region(puntos['coordenadas'][borde], region)]
+        resultado = np.concatenate([interiores, borde])
+        
+        if devolver == 'coordenadas':
+            return puntos['coordenadas'][resultado]
+        return resultado
+    
+    def _etiquetar_disperso(self, indices, claves, conectividad):
+        """
+        Union-find vectorizado sobre las claves de las celdas ocupadas: cada ronda
+        une las raíces de las celdas vecinas y comprime los caminos
+        """
+        desplazamientos = [(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                           if (i, j, k) > (0, 0, 0)
+                           and abs(i) + abs(j) + abs(k) <= {6: 1, 18: 2, 26: 3}[conectividad]]
+        origenes, destinos = [], []
+        for desplazamiento in desplazamientos:
+            posiciones = _buscar_claves(claves, _codificar_claves(indices + desplazamiento, consulta=True))
+            vecinas = posiciones >= 0
+            origenes.append(np.flatnonzero(vecinas))
+            destinos.append(posiciones[vecinas])
+        origenes = np.concatenate(origenes)
+        destinos = np.concatenate(destinos)
+        
+        etiquetas = np.arange(len(claves))
+        while True:
+            raices_origen = etiquetas[origenes]
+            raices_destino = etiquetas[destinos]
+            distintas = raices_origen != raices_destino
+            if not np.any(distintas):
+                break
+            raices_origen = raices_origen[distintas]
+            raices_destino = raices_destino[distintas]
+            minimas = np.minimum(raices_origen, raices_destino)
+            np.minimum.at(etiquetas, raices_origen, minimas)
+            np.minimum.at(etiquetas, raices_destino, minimas)
+            
+            # Compresión de caminos: cada celda apunta directamente a su raíz
+            while True:
+                comprimidas = etiquetas[etiquetas]
+                if np.array_equal(comprimidas, etiquetas):
+                    break
+                etiquetas = comprimidas
+        return etiquetas
+    
+    def _etiquetar_denso(self, indices, conectividad):
+        """Etiquetado con scipy.ndimage.label sobre la caja envolvente de las celdas"""
+        from scipy import ndimage
+        
+        minimo = indices.min(axis=0)
+        relativos = indices - minimo
+        ocupacion = np.zeros(relativos.max(axis=0) + 1, dtype=bool)
+        ocupacion[tuple(relativos.T)] = True
+        estructura = ndimage.generate_binary_structure(3, {6: 1, 18: 2, 26: 3}[conectividad])
+        etiquetas_densas, _ = ndimage.label(ocupacion, structure=estructura)
+        return etiquetas_densas[tuple(relativos.T)]
+    
+    def componentes_conexas(self, conectividad=26, modo='disperso', min_puntos_celda=1,
+                            max_voxeles_denso=50000000):
+        """
+        Agrupa las celdas ocupadas en componentes conexas (conectividad 6, 18 o 26).
+        En modo 'disperso' se usa union-find sobre las claves de celda; en modo
+        'denso' se etiqueta una matriz 3D con scipy.ndimage. La matriz cubre la caja
+        envolvente de las celdas (unos 5 bytes por celda); si supera
+        max_voxeles_denso celdas se usa el modo disperso, y el modo usado se
+        devuelve en 'modo'. Las celdas con menos de min_puntos_celda puntos se
+        ignoran. Las componentes se ordenan de mayor a menor número de puntos y
+        sus estadísticas salen de las sumas de las celdas
+        """
+        if conectividad not in (6, 18, 26):
+            raise ValueError(f"Conectividad no válida: {conectividad}")
+        if modo not in ('disperso', 'denso'):
+            raise ValueError(f"Modo de etiquetado desconocido: {modo}")
+        
+        datos = self._arrays_celdas()
+        validas = datos['num_puntos'] >= min_puntos_celda
+        indices = datos['indices'][validas]
+        claves = datos['claves'][validas]
+        conteos = datos['num_puntos'][validas]
+        sumas = datos['sumas'][validas]
+        if len(claves) == 0:
+            return {'num_componentes': 0, 'modo': modo, 'etiquetas': np.empty(0, dtype=np.int64),
+                    'indices_celda': indices, 'num_celdas': np.empty(0, dtype=np.int64),
+                    'num_puntos': np.empty(0, dtype=np.int64), 'centroides': np.empty((0, 3)),
+                    'minimos': np.empty((0, 3)), 'maximos': np.empty((0, 3))}
+        
+        if modo == 'denso':
+            volumen = int(np.prod(indices.max(axis=0) - indices.min(axis=0) + 1, dtype=np.float64))
+            if volumen > max_voxeles_denso:
+                print(f"Componentes conexas: la caja envolvente tiene {volumen} celdas "
+                      f"(máximo {max_voxeles_denso}), se usa el modo disperso")
+                modo = 'disperso'
+        if modo == 'disperso':
+            raices = self._etiquetar_disperso(indices, claves, conectividad)
+        else:
+            raices = self._etiquetar_denso(indices, conectividad)
+        _, etiquetas = np.unique(raices, return_inverse=True)
+        num_componentes = int(etiquetas.max()) + 1
+        
+        # Reordenar las componentes de mayor a menor número de puntos
+        puntos_componente = np.bincount(etiquetas, conteos, num_componentes)
+        orden = np.argsort(-puntos_componente, kind='stable')
+        rango = np.empty(num_componentes, dtype=np.int64)
+        rango[orden] = np.arange(num_componentes)
+        etiquetas = rango[etiquetas]
+        
+        num_puntos = np.bincount(etiquetas, conteos, num_componentes).astype(np.int64)
+        centroides = np.stack([np.bincount(etiquetas, sumas[:, a], num_componentes)
+                               for a in range(3)], axis=1) / num_puntos[:, None]
+        minimos = np.full((num_componentes, 3), np.inf)
+        maximos = np.full((num_componentes, 3), -np.inf)
+        np.minimum.at(minimos, etiquetas, indices * self.tamaño_celda)
+        np.maximum.at(maximos, etiquetas, (indices + 1) * self.tamaño_celda)
+        
+        return {
+            'num_componentes': num_componentes,
+            'modo': modo,
+            'etiquetas': etiquetas,
+            'indices_celda': indices,
+            'num_celdas': np.bincount(etiquetas, minlength=num_componentes),
+            'num_puntos': num_puntos,
+            'centroides': centroides,
+            'minimos': minimos,
+            'maximos': maximos
+        }
+    
+    def mapa_elevacion(self, eje_vertical=2):
+        """
+        Proyecta la rejilla en un mapa de elevación 2.5D con columnas del mismo
+        tamaño que las celdas, reduciendo en bloque las celdas ocupadas
+        """
+        datos = self._arrays_celdas()
+        mapa = MapaElevacion(self.tamaño_celda, eje_vertical)
+        mapa.integrar_columnas(datos['indices'][:, mapa.ejes_horizontales],
+                               datos['minimos'][:, eje_vertical], datos['maximos'][:, eje_vertical],
+                               datos['num_puntos'])
+        return mapa
+    
     def obtener_estadisticas(self):
         """Calcula estadísticas de la rejilla"""
         num_celdas_ocupadas = len(self.celdas)
@@ -175,39 +1025,46 @@ class RejillaOcupacion:
         
         # Calcular memoria aproximada (en bytes)
         memoria_bytes = sys.getsizeof(self.celdas)
+        ahorro_bytes = 0
         for celda in self.celdas.values():
-            memoria_bytes += sys.getsizeof(celda) + sys.getsizeof(celda.puntos)
-            memoria_bytes += sum(sys.getsizeof(p) for p in celda.puntos)
+            memoria_bytes += sys.getsizeof(celda) + _memoria_puntos(celda.puntos)
+            if isinstance(celda.puntos, ListaPuntosCuantizada):
+                ahorro_bytes += celda.puntos.memoria_sin_cuantizar() - sys.getsizeof(celda.puntos)
+        
+        # Cota del error por eje de las coordenadas cuantizadas
+        error_cuantizacion = 0.0
+        if self.bits_cuantizacion is not None:
+            error_cuantizacion = self.tamaño_celda / ((1 << self.bits_cuantizacion) - 1) / 2
         
         return {
             'num_celdas_ocupadas': num_celdas_ocupadas,
             'num_celdas_vacias': num_celdas_vacias,
             'media_puntos_celda': media_puntos_celda,
             'memoria_bytes': memoria_bytes,
-            'memoria_mb': memoria_bytes / (1024 * 1024)
+            'memoria_mb': memoria_bytes / (1024 * 1024),
+            'ahorro_cuantizacion_bytes': ahorro_bytes,
+            'error_cuantizacion_max': error_cuantizacion
         }
 
-class NodoOctree:
+class NodoOctree(_EstadisticasPuntos):
     """Nodo para la estructura Octree"""
     
-    def __init__(self, centro, tamaño):
+    def __init__(self, centro, tamaño, puntos=None):
         self.centro = centro  # (x, y, z)
         self.tamaño = tamaño
-        self.puntos = []
+        # Lista de puntos o almacén cuantizado (ListaPuntosCuantizada)
+        self.puntos = [] if puntos is None else puntos
         self.hijos = [None] * 8  # 8 hijos para un octree
         self.es_hoja = True
-        self.num_puntos = 0
-        self.suma_x = 0.0
-        self.suma_y = 0.0
-        self.suma_z = 0.0
+        self._iniciar_estadisticas()
+        # Rango de los puntos del subárbol en Octree.obtener_coordenadas()
+        self.inicio = 0
+        self.total = 0
     
     def agregar_punto(self, punto):
         """Agrega un punto al nodo"""
         self.puntos.append(punto)
-        self.num_puntos += 1
-        self.suma_x += punto.x
-        self.suma_y += punto.y
-        self.suma_z += punto.z
+        self._acumular_punto(punto)
     
     def obtener_media(self):
         """Calcula la media de los puntos en el nodo"""
@@ -226,14 +1083,19 @@ class NodoOctree:
                 self.centro[1] - half_size <= punto.y < self.centro[1] + half_size and
                 self.centro[2] - half_size <= punto.z < self.centro[2] + half_size)
 
-class Octree:
+class Octree(_ConsultasEspaciales):
     """Implementación de estructura Octree 3D"""
     
-    def __init__(self, tamaño_minimo=1.0):
+    def __init__(self, tamaño_minimo=1.0, bits_cuantizacion=None):
         self.tamaño_minimo = tamaño_minimo
+        # Si se indica (8 o 16), las hojas de tamaño mínimo guardan sus puntos
+        # cuantizados; los nodos mayores se subdividen y conservan la precisión
+        self.bits_cuantizacion = bits_cuantizacion
         self.raiz = None
         self.num_puntos_total = 0
         self.num_nodos = 0
+        # Datos derivados del árbol; se invalidan al insertar puntos
+        self._cache = {}
     
     def _calcular_limites(self, puntos):
         """Calcula los límites del espacio de puntos"""
@@ -261,13 +1123,56 @@ class Octree:
             return
         
         centro, tamaño = self._calcular_limites(puntos)
-        self.raiz = NodoOctree(centro, tamaño)
+        self.raiz = self._crear_nodo(centro, tamaño)
         self.num_nodos = 1
+        self._cache.clear()
         
         for punto in puntos:
             self._insertar_punto(self.raiz, punto)
             self.num_puntos_total += 1
     
+    def agregar_puntos(self, puntos):
+        """
+        Inserta puntos en un octree ya construido. Si alguno queda fuera de la
+        raíz, esta se duplica hacia él en lugar de descartarlo
+        """
+        if not puntos:
+            return
+    
+        # Una raíz hoja no puede colgar de un padre sin romper el tamaño de las hojas
+        if self.raiz is None or self.raiz.es_hoja:
+            existentes = list(self.raiz.puntos) if self.raiz is not None else []
+            self.num_puntos_total = 0
+            self.construir_octree(existentes + list(puntos))
+            return
+    
+        minimo = (min(p.x for p in puntos), min(p.y for p in puntos), min(p.z for p in puntos))
+        maximo = (max(p.x for p in puntos), max(p.y for p in puntos), max(p.z for p in puntos))
+        self._expandir_raiz(minimo, maximo)
+        self._cache.clear()
+    
+        for punto in puntos:
+            self._insertar_punto(self.raiz, punto)
+            self.num_puntos_total += 1
+    
+    def _expandir_raiz(self, minimo, maximo):
+        """Duplica la raíz, dejando la anterior como hijo, hasta que contenga la caja dada"""
+        while True:
+            mitad = self.raiz.tamaño / 2
+            centro = self.raiz.centro
+            por_debajo = [minimo[i] < centro[i] - mitad for i in range(3)]
+            por_encima = [maximo[i] >= centro[i] + mitad for i in range(3)]
+            if not any(por_debajo) and not any(por_encima):
+                return
+    
+            nuevo_centro = tuple(centro[i] - mitad if por_debajo[i] else centro[i] + mitad
+                                 for i in range(3))
+            nueva_raiz = self._crear_nodo(nuevo_centro, self.raiz.tamaño * 2)
+            nueva_raiz.es_hoja = False
+            nueva_raiz.hijos[self._obtener_indice_hijo(nueva_raiz, PuntoNube(*centro))] = self.raiz
+            self.raiz = nueva_raiz
+            self.num_nodos += 1
+    
     def _insertar_punto(self, nodo, punto):
         """Inserta un punto en el octree"""
         if not nodo.contiene_punto(punto):
@@ -286,11 +1191,18 @@ class Octree:
         indice_hijo = self._obtener_indice_hijo(nodo, punto)
         if nodo.hijos[indice_hijo] is None:
             nuevo_centro = self._calcular_centro_hijo(nodo.centro, nodo.tamaño, indice_hijo)
-            nodo.hijos[indice_hijo] = NodoOctree(nuevo_centro, nodo.tamaño / 2)
+            nodo.hijos[indice_hijo] = self._crear_nodo(nuevo_centro, nodo.tamaño / 2)
             self.num_nodos += 1
         
         return self._insertar_punto(nodo.hijos[indice_hijo], punto)
     
+    def _crear_nodo(self, centro, tamaño):
+        """Crea un nodo con el almacenamiento de puntos configurado"""
+        if self.bits_cuantizacion is None or tamaño > self.tamaño_minimo:
+            return NodoOctree(centro, tamaño)
+        origen = np.array(centro) - tamaño / 2
+        return NodoOctree(centro, tamaño, ListaPuntosCuantizada(origen, tamaño, self.bits_cuantizacion))
+    
     def _subdividir_nodo(self, nodo):
         """Subdivide un nodo en 8 hijos"""
         nodo.es_hoja = False
@@ -303,7 +1215,7 @@ class Octree:
             indice_hijo = self._obtener_indice_hijo(nodo, punto)
             if nodo.hijos[indice_hijo] is None:
                 nuevo_centro = self._calcular_centro_hijo(nodo.centro, nodo.tamaño, indice_hijo)
-                nodo.hijos[indice_hijo] = NodoOctree(nuevo_centro, nodo.tamaño / 2)
+                nodo.hijos[indice_hijo] = self._crear_nodo(nuevo_centro, nodo.tamaño / 2)
                 self.num_nodos += 1
             
             nodo.hijos[indice_hijo].agregar_punto(punto)
@@ -329,8 +1241,123 @@ class Octree:
         
         return (x, y, z)
     
+    def _indexar(self):
+        """
+        Recorre el árbol en profundidad y guarda en cada nodo el rango que ocupan
+        los puntos de su subárbol (inicio, total) en el array de coordenadas
+        """
+        if 'coordenadas' not in self._cache:
+            # Bloques de coordenadas en orden: listas de PuntoNube consecutivas
+            # o arrays ya decodificados de las hojas cuantizadas
+            bloques = [[]]
+            num_puntos = 0
+            pendientes = [self.raiz] if self.raiz is not None else []
+            visitados = []
+            while pendientes:
+                nodo = pendientes.pop()
+                nodo.inicio = num_puntos
+                visitados.append(nodo)
+                if nodo.es_hoja:
+                    if isinstance(nodo.puntos, ListaPuntosCuantizada):
+                        bloques.extend([nodo.puntos.a_array(), []])
+                    else:
+                        bloques[-1].extend(nodo.puntos)
+                    num_puntos += len(nodo.puntos)
+                else:
+                    pendientes.extend(hijo for hijo in reversed(nodo.hijos) if hijo is not None)
+            
+            # Los nodos visitados después de uno dentro de su subárbol son descendientes;
+            # el total se obtiene recorriendo en orden inverso
+            for nodo in reversed(visitados):
+                if nodo.es_hoja:
+                    nodo.total = len(nodo.puntos)
+                else:
+                    nodo.total = sum(hijo.total for hijo in nodo.hijos if hijo is not None)
+            
+            self._cache['coordenadas'] = np.concatenate(
+                [bloque if isinstance(bloque, np.ndarray) else LectorPCD.puntos_a_array(bloque)
+                 for bloque in bloques])
+        return self._cache['coordenadas']
+    
+    def obtener_coordenadas(self):
+        """
+        Devuelve las coordenadas de los puntos de las hojas como array (N, 3).
+        Los índices que devuelven las consultas espaciales se refieren a este array
+        """
+        return self._indexar()
+    
+    def _consulta_region(self, region, devolver):
+        """Desciende por el árbol descartando los subárboles fuera de la región"""
+        coordenadas = self._indexar()
+        rangos_completos = []
+        candidatos = []
+        pendientes = [self.raiz] if self.raiz is not None else []
+        
+        while pendientes:
+            nodos = [nodo for nodo in pendientes if nodo.total > 0]
+            pendientes = []
+            if not nodos:
+                break
+            centros = np.array([nodo.centro for nodo in nodos])
+            mitades = np.array([nodo.tamaño / 2 for nodo in nodos])[:, None]
+            clases = _clasificar_cajas(centros - mitades, centros + mitades, region)
+            
+            for nodo, clase in zip(nodos, clases.tolist()):
+                if clase == 2:
+                    rangos_completos.append((nodo.inicio, nodo.total))
+                elif clase == 1 and nodo.es_hoja:
+                    candidatos.append((nodo.inicio, nodo.total))
+                elif clase == 1:
+                    pendientes.extend(hijo for hijo in nodo.hijos if hijo is not None)
+        
+        completos = np.array(rangos_completos, dtype=np.int64).reshape(-1, 2)
+        parciales = np.array(candidatos, dtype=np.int64).reshape(-1, 2)
+        interiores = _expandir_rangos(completos[:, 0], completos[:, 1])
+        borde = _expandir_rangos(parciales[:, 0], parciales[:, 1])
+        borde = borde[_puntos_en_region(coordenadas[borde], region)]
+        resultado = np.concatenate([interiores, borde])
+        
+        if devolver == 'coordenadas':
+            return coordenadas[resultado]
+        return resultado
+    
+    def mapa_elevacion(self, tamaño_celda=None, eje_vertical=2):
+        """
+        Proyecta las hojas ocupadas en un mapa de elevación 2.5D. Cada hoja se
+        asigna a la columna de su centroide; por defecto las columnas tienen el
+        tamaño mínimo de nodo
+        """
+        hojas = []
+        pendientes = [self.raiz] if self.raiz is not None else []
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo.es_hoja:
+                if nodo.num_puntos > 0:
+                    hojas.append((nodo.suma_x, nodo.suma_y, nodo.suma_z,
+                                  nodo.min_x, nodo.min_y, nodo.min_z,
+                                  nodo.max_x, nodo.max_y, nodo.max_z, nodo.num_puntos))
+            else:
+                pendientes.extend(hijo for hijo in nodo.hijos if hijo is not None)
+        
+        mapa = MapaElevacion(tamaño_celda or self.tamaño_minimo, eje_vertical)
+        hojas = np.array(hojas, dtype=np.float64).reshape(-1, 10)
+        centroides = hojas[:, 0:3] / hojas[:, 9:10]
+        columnas = np.floor(centroides[:, mapa.ejes_horizontales] / mapa.tamaño_celda).astype(np.int64)
+        mapa.integrar_columnas(columnas, hojas[:, 3 + eje_vertical], hojas[:, 6 + eje_vertical],
+                               hojas[:, 9].astype(np.int64))
+        return mapa
+    
     def obtener_estadisticas(self):
         """Calcula estadísticas del octree"""
+        # Cota del error por eje: las hojas cuantizadas tienen el tamaño de las
+        # primeras subdivisiones de la raíz que no superan el tamaño mínimo
+        error_cuantizacion = 0.0
+        if self.bits_cuantizacion is not None and self.raiz is not None:
+            tamaño_hoja = self.raiz.tamaño
+            while tamaño_hoja > self.tamaño_minimo:
+                tamaño_hoja /= 2
+            error_cuantizacion = float(tamaño_hoja) / ((1 << self.bits_cuantizacion) - 1) / 2
+        
         if self.raiz is None:
             return {
                 'num_nodos': 0,
@@ -339,7 +1366,9 @@ class Octree:
                 'num_nodos_vacios': 0,
                 'media_puntos_nodo': 0,
                 'memoria_bytes': 0,
-                'memoria_mb': 0
+                'memoria_mb': 0,
+                'ahorro_cuantizacion_bytes': 0,
+                'error_cuantizacion_max': error_cuantizacion
             }
         
         stats = self._calcular_estadisticas_nodo(self.raiz)
@@ -354,7 +1383,9 @@ class Octree:
             'num_nodos_vacios': stats['num_vacios'],
             'media_puntos_nodo': stats['total_puntos'] / stats['num_ocupados'] if stats['num_ocupados'] > 0 else 0,
             'memoria_bytes': memoria_bytes,
-            'memoria_mb': memoria_bytes / (1024 * 1024)
+            'memoria_mb': memoria_bytes / (1024 * 1024),
+            'ahorro_cuantizacion_bytes': self._calcular_ahorro_nodo(self.raiz),
+            'error_cuantizacion_max': error_cuantizacion
         }
     
     def _calcular_estadisticas_nodo(self, nodo):
@@ -387,14 +1418,639 @@ class Octree:
         if nodo is None:
             return 0
         
-        memoria = sys.getsizeof(nodo) + sys.getsizeof(nodo.puntos)
-        memoria += sum(sys.getsizeof(p) for p in nodo.puntos)
+        memoria = sys.getsizeof(nodo) + _memoria_puntos(nodo.puntos)
         
         for hijo in nodo.hijos:
             if hijo is not None:
                 memoria += self._calcular_memoria_nodo(hijo)
         
         return memoria
+    
+    def _calcular_ahorro_nodo(self, nodo):
+        """Calcula recursivamente la memoria ahorrada por las hojas cuantizadas"""
+        ahorro = 0
+        if isinstance(nodo.puntos, ListaPuntosCuantizada):
+            ahorro += nodo.puntos.memoria_sin_cuantizar() - sys.getsizeof(nodo.puntos)
+        
+        for hijo in nodo.hijos:
+            if hijo is not None:
+                ahorro += self._calcular_ahorro_nodo(hijo)
+        
+        return ahorro
+
+class MapaElevacion:
+    """
+    Mapa de elevación 2.5D para planificación de robots terrestres. Cada columna
+    (i, j) guarda la altura mínima y máxima de sus puntos y cuántos hay. Las
+    columnas se combinan con mínimos y máximos, por lo que el mapa se puede
+    actualizar de forma incremental con nuevos escaneos. La altura se mide en
+    eje_vertical (0, 1 o 2); los escaneos de Datos usan la y como vertical
+    """
+    
+    def __init__(self, tamaño_celda=1.0, eje_vertical=2):
+        if eje_vertical not in (0, 1, 2):
+            raise ValueError(f"Eje vertical no válido: {eje_vertical}")
+        self.tamaño_celda = tamaño_celda
+        self.eje_vertical = eje_vertical
+        self.ejes_horizontales = [eje for eje in range(3) if eje != eje_vertical]
+        self.origen = np.zeros(2, dtype=np.int64)  # Índices (i, j) de la primera columna
+        self.altura_min = np.empty((0, 0))
+        self.altura_max = np.empty((0, 0))
+        self.num_puntos = np.empty((0, 0), dtype=np.int64)
+    
+    def _ampliar(self, indice_min, indice_max):
+        """Amplía las matrices para que abarquen las columnas indicadas"""
+        if self.num_puntos.size > 0:
+            indice_min = np.minimum(indice_min, self.origen)
+            indice_max = np.maximum(indice_max, self.origen + self.num_puntos.shape - 1)
+        forma = tuple(indice_max - indice_min + 1)
+        if forma == self.num_puntos.shape:
+            return
+        
+        desplazamiento = self.origen - indice_min
+        filas = slice(desplazamiento[0], desplazamiento[0] + self.num_puntos.shape[0])
+        columnas = slice(desplazamiento[1], desplazamiento[1] + self.num_puntos.shape[1])
+        for nombre, relleno, tipo in (('altura_min', np.inf, np.float64), ('altura_max', -np.inf, np.float64),
+                                      ('num_puntos', 0, np.int64)):
+            nueva = np.full(forma, relleno, dtype=tipo)
+            nueva[filas, columnas] = getattr(self, nombre)
+            setattr(self, nombre, nueva)
+        self.origen = indice_min
+    
+    def integrar_columnas(self, columnas, altura_min, altura_max, num_puntos):
+        """Combina estadísticas ya reducidas de columnas (K, 2) con el mapa"""
+        columnas = np.asarray(columnas, dtype=np.int64).reshape(-1, 2)
+        if len(columnas) == 0:
+            return
+        self._ampliar(columnas.min(axis=0), columnas.max(axis=0))
+        
+        filas, cols = (columnas - self.origen).T
+        np.minimum.at(self.altura_min, (filas, cols), altura_min)
+        np.maximum.at(self.altura_max, (filas, cols), altura_max)
+        np.add.at(self.num_puntos, (filas, cols), num_puntos)
+    
+    def integrar_puntos(self, coordenadas):
+        """Añade un nuevo escaneo (array (N, 3) o lista de puntos) al mapa"""
+        coordenadas = _a_coordenadas(coordenadas)
+        columnas = np.floor(coordenadas[:, self.ejes_horizontales] / self.tamaño_celda).astype(np.int64)
+        alturas = coordenadas[:, self.eje_vertical]
+        self.integrar_columnas(columnas, alturas, alturas, np.ones(len(coordenadas), dtype=np.int64))
+    
+    def calcular_transitabilidad(self, max_escalon=0.3, max_pendiente=30.0):
+        """
+        Estima, a partir de la altura máxima de cada columna, el escalón (mayor
+        diferencia de altura con sus 8 vecinas observadas) y la pendiente en
+        grados. Una columna es transitable si está observada y ambos valores
+        no superan los límites
+        """
+        altura = np.where(self.num_puntos > 0, self.altura_max, np.nan)
+        escalon = np.zeros_like(altura)
+        pendiente = np.zeros_like(altura)
+        borde = np.pad(altura, 1, constant_values=np.nan)
+        filas, columnas = altura.shape
+        
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                if di == 0 and dj == 0:
+                    continue
+                vecina = borde[1 + di:1 + di + filas, 1 + dj:1 + dj + columnas]
+                diferencia = np.nan_to_num(np.abs(vecina - altura), nan=0.0)
+                escalon = np.maximum(escalon, diferencia)
+                pendiente = np.maximum(pendiente, diferencia / (self.tamaño_celda * math.hypot(di, dj)))
+        
+        observada = self.num_puntos > 0
+        pendiente = np.degrees(np.arctan(pendiente))
+        return {
+            'altura': altura,
+            'escalon': np.where(observada, escalon, np.nan),
+            'pendiente': np.where(observada, pendiente, np.nan),
+            'transitable': observada & (escalon <= max_escalon) & (pendiente <= max_pendiente)
+        }
+    
+    def a_array(self, max_escalon=0.3, max_pendiente=30.0):
+        """
+        Exporta el mapa como array (filas, columnas, 6) con los canales altura
+        mínima, altura máxima, número de puntos, escalón, pendiente y transitable.
+        Las columnas sin observar tienen NaN en las alturas
+        """
+        transitabilidad = self.calcular_transitabilidad(max_escalon, max_pendiente)
+        observada = self.num_puntos > 0
+        return np.stack([np.where(observada, self.altura_min, np.nan),
+                         np.where(observada, self.altura_max, np.nan),
+                         self.num_puntos.astype(np.float64),
+                         transitabilidad['escalon'],
+                         transitabilidad['pendiente'],
+                         transitabilidad['transitable'].astype(np.float64)], axis=-1)
+    
+    def guardar(self, ruta_archivo, canal='altura_max', max_escalon=0.3, max_pendiente=30.0):
+        """
+        Guarda el mapa completo como .npy o un canal ('altura_min', 'altura_max',
+        'num_puntos', 'escalon', 'pendiente', 'transitable') como imagen
+        """
+        datos = self.a_array(max_escalon, max_pendiente)
+        if ruta_archivo.endswith('.npy'):
+            np.save(ruta_archivo, datos)
+            return
+        
+        import matplotlib.pyplot as plt
+        
+        canales = ['altura_min', 'altura_max', 'num_puntos', 'escalon', 'pendiente', 'transitable']
+        # Las filas corresponden al primer eje horizontal; se transpone para que sea el eje de la imagen
+        plt.imsave(ruta_archivo, datos[:, :, canales.index(canal)].T, origin='lower', cmap='viridis')
+    
+    def obtener_limites(self):
+        """Esquina inferior y superior del área cubierta, en los ejes horizontales"""
+        minimo = self.origen * self.tamaño_celda
+        return minimo, minimo + np.array(self.num_puntos.shape) * self.tamaño_celda
+
+class IndiceVecinos:
+    """
+    Índice espacial para búsqueda de vecinos más cercanos basado en la misma
+    discretización en celdas que RejillaOcupacion. Los puntos se ordenan por
+    clave de celda y cada consulta examina su celda y solo las celdas vecinas
+    que pueden contener un punto más cercano. Las consultas sin vecino en ese
+    entorno se resuelven con niveles de celdas de tamaño creciente
+    """
+    
+    def __init__(self, coordenadas, tamaño_celda=1.0):
+        self.tamaño_celda = tamaño_celda
+        coordenadas = _a_coordenadas(coordenadas)
+        
+        claves = _codificar_claves(np.floor(coordenadas / tamaño_celda).astype(np.int64))
+        self.orden = np.argsort(claves, kind='stable')
+        self.coordenadas = coordenadas[self.orden]
+        self.claves, self.inicios, conteos = np.unique(claves[self.orden], return_index=True,
+                                                       return_counts=True)
+        self.finales = self.inicios + conteos
+        self._niveles_gruesos = {}
+        
+        rango = (-1, 0, 1)
+        self._vecinas = np.array([(i, j, k) for i in rango for j in rango for k in rango
+                                  if (i, j, k) != (0, 0, 0)])
+    
+    def _evaluar_celdas(self, consultas, celdas, consulta_de_par, desplazamientos,
+                        minimos, mejores, max_candidatos):
+        """
+        Compara cada consulta con los puntos de la celda indicada por su par
+        (consulta, desplazamiento) y actualiza minimos y mejores en el sitio
+        """
+        claves = _codificar_claves(celdas[consulta_de_par] + desplazamientos, consulta=True)
+        posiciones = _buscar_claves(self.claves, claves)
+        presentes = posiciones >= 0
+        consulta_de_rango = consulta_de_par[presentes]
+        comienzos = self.inicios[posiciones[presentes]]
+        longitudes = self.finales[posiciones[presentes]] - comienzos
+        if len(longitudes) == 0:
+            return
+        
+        # Procesar los rangos en trozos de como máximo max_candidatos puntos
+        acumulado = np.cumsum(longitudes)
+        cortes = np.searchsorted(acumulado, np.arange(max_candidatos, acumulado[-1], max_candidatos))
+        for rangos in np.split(np.arange(len(longitudes)), np.unique(cortes)):
+            if len(rangos) == 0:
+                continue
+            consulta_candidato = np.repeat(consulta_de_rango[rangos], longitudes[rangos])
+            candidatos = _expandir_rangos(comienzos[rangos], longitudes[rangos])
+            
+            diferencias = self.coordenadas[candidatos] - consultas[consulta_candidato]
+            d2 = np.einsum('ij,ij->i', diferencias, diferencias)
+            
+            minimos_trozo = np.full(len(consultas), np.inf)
+            np.minimum.at(minimos_trozo, consulta_candidato, d2)
+            es_minimo = d2 == minimos_trozo[consulta_candidato]
+            mejores_trozo = np.empty(len(consultas), dtype=np.int64)
+            mejores_trozo[consulta_candidato[es_minimo]] = self.orden[candidatos[es_minimo]]
+            
+            mejora = minimos_trozo < minimos
+            minimos[mejora] = minimos_trozo[mejora]
+            mejores[mejora] = mejores_trozo[mejora]
+    
+    def _buscar_entorno(self, consultas, minimos, mejores, distancia_maxima, max_candidatos):
+        """
+        Busca en la celda de cada consulta y en las 26 vecinas. El resultado es
+        exacto para las consultas cuyo vecino está a menos de tamaño_celda
+        """
+        celdas = np.floor(consultas / self.tamaño_celda).astype(np.int64)
+        
+        # Primera pasada: solo la celda de cada consulta
+        self._evaluar_celdas(consultas, celdas, np.arange(len(consultas)),
+                             np.zeros((1, 3), dtype=np.int64), minimos, mejores, max_candidatos)
+        
+        # Segunda pasada: celdas vecinas cuya distancia mínima a la consulta
+        # es menor que el mejor candidato encontrado y que distancia_maxima
+        limite2 = np.minimum(minimos, distancia_maxima ** 2)
+        relativa = consultas / self.tamaño_celda - celdas
+        vecinas = self._vecinas[None, :, :]
+        exceso = np.where(vecinas > 0, vecinas - relativa[:, None, :],
+                          np.where(vecinas < 0, relativa[:, None, :] - vecinas - 1, 0.0))
+        distancia_celda2 = np.einsum('qvi,qvi->qv', exceso, exceso) * self.tamaño_celda ** 2
+        consulta_de_par, vecina_de_par = np.nonzero(distancia_celda2 < limite2[:, None])
+        self._evaluar_celdas(consultas, celdas, consulta_de_par, self._vecinas[vecina_de_par],
+                             minimos, mejores, max_candidatos)
+    
+    def _nivel_grueso(self, tamaño_celda):
+        """Devuelve (y guarda) un índice de los mismos puntos con otro tamaño de celda"""
+        if tamaño_celda not in self._niveles_gruesos:
+            coordenadas = np.empty_like(self.coordenadas)
+            coordenadas[self.orden] = self.coordenadas
+            self._niveles_gruesos[tamaño_celda] = IndiceVecinos(coordenadas, tamaño_celda)
+        return self._niveles_gruesos[tamaño_celda]
+    
+    def vecino_mas_cercano(self, consultas, distancia_maxima=None, tamaño_bloque=50000,
+                           max_candidatos=2000000):
+        """
+        Busca el punto indexado más cercano a cada consulta dentro de
+        distancia_maxima (por defecto el tamaño de celda). Devuelve
+        (índices en el array original, distancias); las consultas sin vecino
+        reciben índice -1 y distancia infinita
+        """
+        if distancia_maxima is None:
+            distancia_maxima = self.tamaño_celda
+        consultas = _a_coordenadas(consultas)
+        indices = np.full(len(consultas), -1, dtype=np.int64)
+        distancias2 = np.full(len(consultas), np.inf)
+        
+        for inicio in range(0, len(consultas), tamaño_bloque):
+            bloque = consultas[inicio:inicio + tamaño_bloque]
+            mejores = indices[inicio:inicio + len(bloque)]
+            minimos = distancias2[inicio:inicio + len(bloque)]
+            
+            # Las consultas cuyo vecino puede estar fuera de las 27 celdas
+            # examinadas pasan a un nivel con celdas del doble de tamaño
+            pendientes = np.arange(len(bloque))
+            nivel = self
+            while True:
+                minimos_pendientes = minimos[pendientes]
+                mejores_pendientes = mejores[pendientes]
+                nivel._buscar_entorno(bloque[pendientes], minimos_pendientes, mejores_pendientes,
+                                      distancia_maxima, max_candidatos)
+                minimos[pendientes] = minimos_pendientes
+                mejores[pendientes] = mejores_pendientes
+                
+                pendientes = pendientes[minimos_pendientes > nivel.tamaño_celda ** 2]
+                if len(pendientes) == 0 or nivel.tamaño_celda >= distancia_maxima:
+                    break
+                nivel = self._nivel_grueso(min(2 * nivel.tamaño_celda, distancia_maxima))
+        
+        distancias = np.sqrt(distancias2)
+        fuera = distancias > distancia_maxima
+        indices[fuera] = -1
+        distancias[fuera] = np.inf
+        return indices, distancias
+
+class RegistroICP:
+    """
+    Registro ICP (Iterative Closest Point) de una nube de puntos contra un mapa.
+    Las correspondencias se obtienen con IndiceVecinos y las normales para la
+    variante punto a plano a partir de la covarianza del entorno de cada punto
+    del mapa (RejillaOcupacion.normales_entorno)
+    """
+    
+    def __init__(self, distancia_maxima=1.0, max_iteraciones=30, tolerancia=1e-5,
+                 metodo='punto_a_plano', tamaño_submuestreo=None, tamaño_celda_indice=None,
+                 tamaño_celda_normales=None, verbose=False):
+        if metodo not in ('punto_a_punto', 'punto_a_plano'):
+            raise ValueError(f"Método de ICP desconocido: {metodo}")
+        self.distancia_maxima = distancia_maxima
+        self.max_iteraciones = max_iteraciones
+        self.tolerancia = tolerancia
+        self.metodo = metodo
+        self.tamaño_submuestreo = tamaño_submuestreo
+        # Celdas pequeñas para el índice de vecinos; las consultas lejanas
+        # se resuelven en sus niveles más gruesos
+        self.tamaño_celda_indice = tamaño_celda_indice or distancia_maxima / 8
+        # Celda más fina para las normales; los puntos sin entorno suficiente
+        # se reintentan con celdas del doble de tamaño hasta distancia_maxima
+        self.tamaño_celda_normales = tamaño_celda_normales or distancia_maxima / 4
+        self.verbose = verbose
+    
+    @staticmethod
+    def aplicar_transformacion(coordenadas, transformacion):
+        """Aplica una transformación homogénea 4x4 a un array (N, 3)"""
+        return coordenadas @ transformacion[:3, :3].T + transformacion[:3, 3]
+    
+    @staticmethod
+    def _submuestrear(coordenadas, tamaño_celda):
+        """Sustituye los puntos de cada celda por su media"""
+        rejilla = RejillaOcupacion(tamaño_celda)
+        rejilla.agregar_puntos_array(coordenadas, guardar_puntos=False)
+        return rejilla.medias_celdas()
+    
+    def _estimar_normales(self, objetivo):
+        """Normal de cada punto del mapa (NaN si no hay entorno suficiente a ninguna escala)"""
+        normales = np.full(objetivo.shape, np.nan)
+        pendientes = np.arange(len(objetivo))
+        tamaño = self.tamaño_celda_normales
+        while len(pendientes) > 0 and tamaño <= self.distancia_maxima * (1 + 1e-9):
+            rejilla = RejillaOcupacion(tamaño)
+            rejilla.agregar_puntos_array(objetivo, guardar_puntos=False)
+            estimadas = rejilla.normales_entorno(objetivo[pendientes])
+            validas = ~np.isnan(estimadas[:, 0])
+            normales[pendientes[validas]] = estimadas[validas]
+            pendientes = pendientes[~validas]
+            tamaño *= 2
+        return normales
+    
+    @staticmethod
+    def _paso_punto_a_punto(origen, destino):
+        """Transformación rígida óptima entre correspondencias (método de Kabsch)"""
+        media_origen = origen.mean(axis=0)
+        media_destino = destino.mean(axis=0)
+        h = (origen - media_origen).T @ (destino - media_destino)
+        u, _, vt = np.linalg.svd(h)
+        d = np.sign(np.linalg.det(vt.T @ u.T))
+        rotacion = vt.T @ np.diag([1.0, 1.0, d]) @ u.T
+        
+        transformacion = np.eye(4)
+        transformacion[:3, :3] = rotacion
+        transformacion[:3, 3] = media_destino - rotacion @ media_origen
+        return transformacion
+    
+    @staticmethod
+    def _paso_punto_a_plano(origen, destino, normales):
+        """Linealiza la rotación y resuelve por mínimos cuadrados el error punto a plano"""
+        a = np.hstack([np.cross(origen, normales), normales])
+        b = np.einsum('ij,ij->i', destino - origen, normales)
+        x, *_ = np.linalg.lstsq(a, b, rcond=None)
+        
+        # Reconstruir una rotación válida a partir de los ángulos pequeños
+        angulo = np.linalg.norm(x[:3])
+        rotacion = np.eye(3)
+        if angulo > 0:
+            eje = x[:3] / angulo
+            k = np.array([[0, -eje[2], eje[1]],
+                          [eje[2], 0, -eje[0]],
+                          [-eje[1], eje[0], 0]])
+            rotacion = np.eye(3) + math.sin(angulo) * k + (1 - math.cos(angulo)) * (k @ k)
+        
+        transformacion = np.eye(4)
+        transformacion[:3, :3] = rotacion
+        transformacion[:3, 3] = x[3:]
+        return transformacion
+    
+    def registrar(self, fuente, objetivo, transformacion_inicial=None):
+        """
+        Alinea la nube fuente contra el mapa objetivo. Ambos pueden ser listas de
+        PuntoNube, arrays (N, 3) o estructuras con obtener_coordenadas. Devuelve
+        un diccionario con la transformación 4x4, si ha convergido y el historial
+        de cada iteración (error, correspondencias y tiempo)
+        """
+        tiempo_inicio = time.perf_counter()
+        fuente = _a_coordenadas(fuente)
+        objetivo = _a_coordenadas(objetivo)
+        if self.tamaño_submuestreo:
+            fuente = self._submuestrear(fuente, self.tamaño_submuestreo)
+        
+        indice = IndiceVecinos(objetivo, self.tamaño_celda_indice)
+        metodo = self.metodo
+        if metodo == 'punto_a_plano':
+            normales = self._estimar_normales(objetivo)
+            if np.isnan(normales[:, 0]).all():
+                print("ICP: el mapa no tiene entorno suficiente para estimar normales, "
+                      "se usa el método punto a punto")
+                metodo = 'punto_a_punto'
+        tiempo_preparacion = time.perf_counter() - tiempo_inicio
+        
+        transformacion = np.eye(4) if transformacion_inicial is None else np.array(transformacion_inicial, dtype=np.float64)
+        historial = []
+        convergido = False
+        error_anterior = None
+        
+        for iteracion in range(1, self.max_iteraciones + 1):
+            tiempo_iteracion = time.perf_counter()
+            transformada = self.aplicar_transformacion(fuente, transformacion)
+            vecinos, distancias = indice.vecino_mas_cercano(transformada, self.distancia_maxima)
+            validos = vecinos >= 0
+            if metodo == 'punto_a_plano':
+                validos &= ~np.isnan(normales[np.maximum(vecinos, 0), 0])
+            
+            num_correspondencias = int(validos.sum())
+            if num_correspondencias < 6:
+                print(f"ICP: correspondencias insuficientes ({num_correspondencias})")
+                break
+            
+            origen = transformada[validos]
+            destino = objetivo[vecinos[validos]]
+            if metodo == 'punto_a_punto':
+                incremento = self._paso_punto_a_punto(origen, destino)
+            else:
+                incremento = self._paso_punto_a_plano(origen, destino, normales[vecinos[validos]])
+            transformacion = incremento @ transformacion
+            
+            error = float(np.sqrt(np.mean(distancias[validos] ** 2)))
+            cambio = np.linalg.norm(incremento[:3, :3] - np.eye(3)) + np.linalg.norm(incremento[:3, 3])
+            historial.append({
+                'iteracion': iteracion,
+                'error_rmse': error,
+                'num_correspondencias': num_correspondencias,
+                'cambio': float(cambio),
+                'tiempo': time.perf_counter() - tiempo_iteracion
+            })
+            if self.verbose:
+                print(f"  Iteración {iteracion}: RMSE={error:.4f}, "
+                      f"correspondencias={num_correspondencias}, "
+                      f"tiempo={historial[-1]['tiempo']:.3f}s")
+            
+            if cambio < self.tolerancia or (error_anterior is not None and
+                                            abs(error_anterior - error) < self.tolerancia):
+                convergido = True
+                break
+            error_anterior = error
+        
+        return {
+            'transformacion': transformacion,
+            'convergido': convergido,
+            'metodo': metodo,
+            'iteraciones': len(historial),
+            'historial': historial,
+            'error_rmse': historial[-1]['error_rmse'] if historial else float('inf'),
+            'tiempo_preparacion': tiempo_preparacion,
+            'tiempo_total': time.perf_counter() - tiempo_inicio
+        }
+
+
+def integrar_nube(estructura, coordenadas, colores=None):
+    """Añade una nube leída como arrays a una RejillaOcupacion u Octree"""
+    if isinstance(estructura, Octree):
+        if colores is None:
+            colores = np.zeros((len(coordenadas), 3), dtype=np.int64)
+        estructura.agregar_puntos([PuntoNube(x, y, z, r, g, b) for (x, y, z), (r, g, b)
+                                   in zip(coordenadas.tolist(), colores.tolist())])
+    else:
+        estructura.agregar_puntos_array(coordenadas, colores)
+
+
+def _leer_midiendo_cpu(funcion_lectura, ruta):
+    """Lee un archivo y devuelve (resultado, tiempo de CPU del hilo que lo leyó)"""
+    tiempo_inicio = time.thread_time()
+    resultado = funcion_lectura(ruta)
+    return resultado, time.thread_time() - tiempo_inicio
+
+
+class PipelineIngesta:
+    """
+    Ingesta de varios archivos PCD en una misma estructura por etapas: varios
+    lectores analizan los siguientes archivos mientras el constructor integra el
+    actual. Las etapas se comunican por una cola acotada, de modo que los lectores
+    se bloquean (contrapresión) si el constructor no da abasto.
+    El tiempo ocupado de cada etapa es tiempo de CPU de sus hilos, que no incluye
+    el tiempo que pasan esperando al GIL o a un núcleo libre
+    """
+    
+    def __init__(self, estructura, num_lectores=2, capacidad_cola=2, usar_procesos=False,
+                 funcion_lectura=None):
+        if num_lectores < 1 or capacidad_cola < 1:
+            raise ValueError("num_lectores y capacidad_cola deben ser al menos 1")
+        self.estructura = estructura  # RejillaOcupacion u Octree
+        self.num_lectores = num_lectores
+        self.capacidad_cola = capacidad_cola
+        # Con procesos el análisis del texto no compite por el GIL con el constructor
+        self.usar_procesos = usar_procesos
+        # funcion_lectura(ruta) -> (coordenadas, colores); debe lanzar una excepción
+        # si falla y, con procesos, poder serializarse
+        self.funcion_lectura = funcion_lectura or functools.partial(LectorPCD.leer_archivo_pcd_array,
+                                                                    estricto=True)
+    
+    def ejecutar(self, rutas, verbose=False):
+        """
+        Lee e integra los archivos en orden y devuelve las métricas de cada etapa:
+        tiempo ocupado y en espera, rendimiento en puntos/s y profundidad de la cola
+        """
+        rutas = list(rutas)
+        cola = queue.Queue(maxsize=self.capacidad_cola)
+        turno = threading.Condition()
+        estado = {'siguiente_lectura': 0, 'siguiente_envio': 0, 'cancelado': False}
+        metricas_lectores = [{'tiempo_ocupado': 0.0, 'tiempo_espera': 0.0} for _ in range(self.num_lectores)]
+        profundidades = []
+        ejecutor = None
+        if self.usar_procesos:
+            from concurrent.futures import ProcessPoolExecutor
+            ejecutor = ProcessPoolExecutor(max_workers=self.num_lectores)
+        
+        def lector(metricas):
+            while True:
+                with turno:
+                    indice = estado['siguiente_lectura']
+                    if indice >= len(rutas) or estado['cancelado']:
+                        return
+                    estado['siguiente_lectura'] += 1
+                
+                try:
+                    if ejecutor is not None:
+                        (coordenadas, colores), tiempo_lectura = ejecutor.submit(
+                            _leer_midiendo_cpu, self.funcion_lectura, rutas[indice]).result()
+                    else:
+                        (coordenadas, colores), tiempo_lectura = _leer_midiendo_cpu(self.funcion_lectura,
+                                                                                    rutas[indice])
+                    error = None
+                except Exception as e:
+                    coordenadas = colores = None
+                    tiempo_lectura = 0.0
+                    error = e
+                metricas['tiempo_ocupado'] += tiempo_lectura
+                
+                # Los archivos entran en la cola en orden para que el resultado
+                # no dependa de qué lector termine antes
+                tiempo_inicio = time.perf_counter()
+                with turno:
+                    turno.wait_for(lambda: estado['siguiente_envio'] == indice or estado['cancelado'])
+                    if estado['cancelado']:
+                        return
+                cola.put((indice, coordenadas, colores, tiempo_lectura, error))
+                profundidades.append(cola.qsize())
+                metricas['tiempo_espera'] += time.perf_counter() - tiempo_inicio
+                with turno:
+                    estado['siguiente_envio'] += 1
+                    turno.notify_all()
+        
+        hilos = [threading.Thread(target=lector, args=(metricas,), daemon=True)
+                 for metricas in metricas_lectores]
+        
+        tiempo_total_inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        
+        por_archivo = []
+        tiempo_construccion = 0.0
+        tiempo_espera_constructor = 0.0
+        errores = []
+        try:
+            for _ in range(len(rutas)):
+                tiempo_inicio = time.perf_counter()
+                profundidades.append(cola.qsize())
+                indice, coordenadas, colores, tiempo_lectura, error = cola.get()
+                tiempo_espera_constructor += time.perf_counter() - tiempo_inicio
+                if error is not None:
+                    errores.append((rutas[indice], error))
+                    continue
+                
+                tiempo_inicio = time.thread_time()
+                integrar_nube(self.estructura, coordenadas, colores)
+                tiempo_integracion = time.thread_time() - tiempo_inicio
+                tiempo_construccion += tiempo_integracion
+                por_archivo.append({
+                    'ruta': rutas[indice],
+                    'puntos': len(coordenadas),
+                    'tiempo_lectura': tiempo_lectura,
+                    'tiempo_construccion': tiempo_integracion
+                })
+                if verbose:
+                    print(f"{rutas[indice]}: {len(coordenadas)} puntos "
+                          f"(lectura {tiempo_lectura:.3f}s, construcción {tiempo_integracion:.3f}s, "
+                          f"cola {cola.qsize()}/{self.capacidad_cola})")
+        finally:
+            # Si el constructor falla, se liberan los lectores bloqueados
+            with turno:
+                estado['cancelado'] = True
+                turno.notify_all()
+            while any(hilo.is_alive() for hilo in hilos):
+                try:
+                    cola.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            if ejecutor is not None:
+                ejecutor.shutdown()
+        tiempo_total = time.perf_counter() - tiempo_total_inicio
+        
+        if errores:
+            ruta, error = errores[0]
+            raise RuntimeError(f"Error leyendo {ruta}: {error}") from error
+        
+        num_puntos = sum(archivo['puntos'] for archivo in por_archivo)
+        tiempo_lectura = sum(metricas['tiempo_ocupado'] for metricas in metricas_lectores)
+        nucleos = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+        return {
+            'archivos': len(por_archivo),
+            'puntos': num_puntos,
+            'tiempo_total': tiempo_total,
+            'rendimiento_puntos_s': num_puntos / tiempo_total if tiempo_total > 0 else 0.0,
+            # Tiempo de CPU de ambas etapas: aproxima lo que costaría leer y construir uno tras otro
+            'tiempo_cpu_etapas': tiempo_lectura + tiempo_construccion,
+            # Cota inferior del tiempo total: la etapa más lenta o, si hay menos
+            # núcleos que hilos, el tiempo de CPU repartido entre los núcleos
+            'tiempo_minimo': max(tiempo_lectura / min(self.num_lectores, nucleos), tiempo_construccion,
+                                 (tiempo_lectura + tiempo_construccion) / nucleos),
+            'nucleos': nucleos,
+            'lectura': {
+                'hilos': self.num_lectores,
+                'tiempo_ocupado': tiempo_lectura,
+                'tiempo_espera': sum(metricas['tiempo_espera'] for metricas in metricas_lectores),
+                # Puntos por segundo de CPU, sumando el tiempo de todos los lectores
+                'rendimiento_puntos_s': num_puntos / tiempo_lectura if tiempo_lectura > 0 else 0.0
+            },
+            'construccion': {
+                'tiempo_ocupado': tiempo_construccion,
+                'tiempo_espera': tiempo_espera_constructor,
+                'rendimiento_puntos_s': num_puntos / tiempo_construccion if tiempo_construccion > 0 else 0.0
+            },
+            'cola': {
+                'capacidad': self.capacidad_cola,
+                'profundidad_max': max(profundidades, default=0),
+                'profundidad_media': float(np.mean(profundidades)) if profundidades else 0.0
+            },
+            'por_archivo': por_archivo
+        }
+
 
 class VisualizadorOctree:
     """Visualizador 3D para octree"""
@@ -404,6 +2060,9 @@ class VisualizadorOctree:
     
     def visualizar_nodos(self, max_nodos=1000):
         """Visualiza los nodos del octree"""
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D  # Registra la proyección 3D
+        
         fig = plt.figure(figsize=(12, 10))
         ax = fig.add_subplot(111, projection='3d')
         
@@ -463,6 +2122,8 @@ class VisualizadorOctree:
             [0, 4], [1, 5], [2, 6], [3, 7]   # Aristas verticales
         ]
         
+        import matplotlib.pyplot as plt
+        
         # Color basado en el número de puntos
         intensidad = min(num_puntos / 100, 1.0)  # Normalizar
         color = plt.cm.viridis(intensidad)
@@ -534,6 +2195,8 @@ class AnalizadorComparativo:
             print("No hay resultados para graficar")
             return
         
+        import matplotlib.pyplot as plt
+        
         tamaños = [r['tamaño_celda'] for r in self.resultados]
         
         # Configurar subplots
@@ -747,6 +2410,218 @@ def pruebas_unitarias():
     assert octree_test.raiz is not None, "La raíz del octree no debe ser None"
     assert octree_test.num_puntos_total == len(puntos_prueba), "Número de puntos incorrecto"
     
+    # Prueba covarianza por celda (incremental frente a vectorizada)
+    print("\nPrueba Covarianza por Celda:")
+    coordenadas = np.random.RandomState(0).uniform(0, 1, size=(200, 3))
+    rejilla_inc = RejillaOcupacion(tamaño_celda=0.5)
+    rejilla_inc.agregar_puntos([PuntoNube(*c) for c in coordenadas])
+    rejilla_vec = RejillaOcupacion(tamaño_celda=0.5)
+    rejilla_vec.agregar_puntos_array(coordenadas, guardar_puntos=False)
+    
+    for indices, celda in rejilla_inc.celdas.items():
+        esperada = np.cov(LectorPCD.puntos_a_array(celda.puntos).T)
+        assert np.allclose(celda.obtener_covarianza(), esperada), "Covarianza incremental incorrecta"
+        assert np.allclose(rejilla_vec.celdas[indices].obtener_covarianza(), esperada), "Covarianza vectorizada incorrecta"
+    medias = {tuple(np.floor(m / 0.5).astype(int)): m for m in rejilla_vec.medias_celdas()}
+    for indices, celda in rejilla_inc.celdas.items():
+        media = celda.obtener_media()
+        assert np.allclose(medias[indices], [media.x, media.y, media.z]), "Media de celda incorrecta"
+    nodo = NodoOctree((0.5, 0.5, 0.5), 1.0)
+    for c in coordenadas:
+        nodo.agregar_punto(PuntoNube(*c))
+    assert np.allclose(nodo.obtener_covarianza(), np.cov(coordenadas.T)), "Covarianza del nodo incorrecta"
+    print(f"✓ Covarianzas correctas en {len(rejilla_inc.celdas)} celdas")
+    
+    # Claves de celda: los extremos del rango se conservan y fuera de él se rechazan
+    limite = _DESPLAZAMIENTO_CLAVE
+    extremos = np.array([[limite - 1, -limite, 0], [-limite, limite - 1, limite - 1]])
+    assert np.array_equal(_decodificar_claves(_codificar_claves(extremos)), extremos), "Claves extremas incorrectas"
+    for fuera in ([limite, 0, 0], [0, -limite - 1, 0]):
+        try:
+            _codificar_claves([fuera])
+            assert False, "Índice de celda fuera de rango aceptado"
+        except ValueError:
+            pass
+    assert _codificar_claves([[0, 0, limite]], consulta=True)[0] == -1
+    try:
+        RejillaOcupacion(0.001).agregar_puntos_array([[0.0015, 0.0005, 0.0005], [0.0005, 2097.1525, 0.0005]])
+        assert False, "Celdas lejanas confundidas en la misma clave"
+    except ValueError:
+        pass
+    
+    puntuaciones = rejilla_vec.puntuacion_ndt(coordenadas)
+    assert puntuaciones.shape == (len(coordenadas),) and np.all(puntuaciones > 0), "Puntuación NDT incorrecta"
+    print(f"✓ Puntuación NDT: {puntuaciones.sum():.2f}")
+    
+    # Prueba ICP: recuperar una transformación conocida
+    print("\nPrueba Registro ICP:")
+    mapa = LectorPCD.puntos_a_array(LectorPCD.generar_datos_sinteticos(num_puntos=2000, rango=5.0))
+    angulo = math.radians(3)
+    transformacion = np.eye(4)
+    transformacion[:2, :2] = [[math.cos(angulo), -math.sin(angulo)], [math.sin(angulo), math.cos(angulo)]]
+    transformacion[:3, 3] = [0.1, -0.05, 0.02]
+    escaneo = RegistroICP.aplicar_transformacion(mapa, np.linalg.inv(transformacion))
+    
+    resultado = RegistroICP(distancia_maxima=1.0, metodo='punto_a_punto').registrar(escaneo, mapa)
+    assert resultado['convergido'], "ICP no ha convergido"
+    assert np.allclose(resultado['transformacion'], transformacion, atol=1e-3), "Transformación ICP incorrecta"
+    print(f"✓ ICP convergido en {resultado['iteraciones']} iteraciones "
+          f"({resultado['tiempo_total']:.3f}s), RMSE: {resultado['error_rmse']:.5f}")
+    
+    # Punto a plano contra un mapa submuestreado (esquina de una habitación):
+    # con celdas de distancia_maxima ninguna tendría puntos para estimar la normal
+    malla = np.stack(np.meshgrid(np.arange(0, 4, 0.1), np.arange(0, 4, 0.1)), axis=-1).reshape(-1, 2)
+    cero = np.zeros((len(malla), 1))
+    habitacion = np.vstack([np.hstack([malla, cero]), np.hstack([cero, malla]),
+                            np.hstack([malla[:, :1], cero, malla[:, 1:]])])
+    mapa_disperso = RegistroICP._submuestrear(habitacion, 0.5)
+    escaneo = RegistroICP.aplicar_transformacion(habitacion, np.linalg.inv(transformacion))
+    resultado = RegistroICP(distancia_maxima=1.0).registrar(escaneo, mapa_disperso)
+    assert resultado['metodo'] == 'punto_a_plano' and resultado['convergido'], "ICP punto a plano no ha convergido"
+    assert resultado['historial'][-1]['num_correspondencias'] == len(escaneo), "Faltan normales en el mapa"
+    assert np.allclose(resultado['transformacion'], transformacion, atol=2e-2), "Transformación punto a plano incorrecta"
+    assert RegistroICP(distancia_maxima=1.0).registrar(escaneo, mapa_disperso[:3])['metodo'] == 'punto_a_punto'
+    print(f"✓ ICP punto a plano sobre mapa submuestreado ({len(mapa_disperso)} puntos) "
+          f"en {resultado['iteraciones']} iteraciones")
+    
+    # Prueba consultas espaciales: ambas estructuras frente a fuerza bruta
+    print("\nPrueba Consultas por Caja y Frustum:")
+    octree_mapa = Octree(tamaño_minimo=0.5)
+    octree_mapa.construir_octree([PuntoNube(*c) for c in mapa])
+    rejilla_mapa = RejillaOcupacion(tamaño_celda=0.5)
+    rejilla_mapa.agregar_puntos_array(mapa)
+    frustum = crear_frustum([0, 0, 0], [1, 1, 0], fov_vertical=45, lejos=6.0)
+    
+    for estructura in (rejilla_mapa, octree_mapa):
+        coordenadas = estructura.obtener_coordenadas()
+        for indices, minimo, maximo in zip(estructura.consulta_cajas([[-1, -1, -1], [0, 2, -5]],
+                                                                     [[1, 1, 1], [3, 4, 5]]),
+                                           [[-1, -1, -1], [0, 2, -5]], [[1, 1, 1], [3, 4, 5]]):
+            esperados = np.flatnonzero(np.all((coordenadas >= minimo) & (coordenadas <= maximo), axis=1))
+            assert np.array_equal(np.sort(indices), esperados), "Consulta por caja incorrecta"
+        visibles = estructura.consulta_frustum(frustum)
+        assert np.all(coordenadas[visibles] @ frustum['planos'][:, :3].T + frustum['planos'][:, 3] >= 0)
+    # Cámara cenital: la dirección coincide con el vector arriba por defecto
+    cenital = crear_frustum([0, 0, 10], [0, 0, -1], lejos=20.0)
+    assert np.all(np.isfinite(cenital['planos'])), "Frustum cenital degenerado"
+    assert len(rejilla_mapa.consulta_frustum(cenital)) > 0, "El frustum cenital no ve ningún punto"
+    print(f"✓ Consultas correctas ({len(visibles)} puntos en el frustum)")
+    
+    # Prueba componentes conexas: dos grupos separados y una celda diagonal
+    print("\nPrueba Componentes Conexas:")
+    rejilla_grupos = RejillaOcupacion(tamaño_celda=1.0)
+    rejilla_grupos.agregar_puntos_array([[0.5, 0.5, 0.5], [1.5, 0.5, 0.5], [2.5, 1.5, 0.5],
+                                         [10.5, 10.5, 10.5], [10.2, 10.7, 10.1]])
+    for conectividad, esperadas in ((6, 3), (18, 2), (26, 2)):
+        for modo in ('disperso', 'denso'):
+            componentes = rejilla_grupos.componentes_conexas(conectividad, modo)
+            assert componentes['num_componentes'] == esperadas, f"Componentes incorrectas ({conectividad}, {modo})"
+    # Caja envolvente de 11x11x11 celdas: por encima del límite se etiqueta en modo disperso
+    limitado = rejilla_grupos.componentes_conexas(26, 'denso', max_voxeles_denso=1000)
+    assert limitado['modo'] == 'disperso' and np.array_equal(limitado['etiquetas'], componentes['etiquetas'])
+    assert componentes['modo'] == 'denso'
+    assert list(componentes['num_puntos']) == [3, 2], "Puntos por componente incorrectos"
+    assert np.allclose(componentes['centroides'][1], [10.35, 10.6, 10.3]), "Centroide incorrecto"
+    print(f"✓ Componentes correctas: {componentes['num_puntos'].tolist()} puntos")
+    
+    # Prueba mapa de elevación: rejilla, octree e integración incremental
+    print("\nPrueba Mapa de Elevación:")
+    suelo = np.array([[0.2, 0.2, 0.0], [0.7, 0.3, 0.1], [1.5, 0.5, 0.05], [1.6, 0.4, 1.2]])
+    rejilla_suelo = RejillaOcupacion(tamaño_celda=1.0)
+    rejilla_suelo.agregar_puntos_array(suelo)
+    octree_suelo = Octree(tamaño_minimo=1.0)
+    octree_suelo.construir_octree([PuntoNube(*p) for p in suelo])
+    for mapa_suelo in (rejilla_suelo.mapa_elevacion(), octree_suelo.mapa_elevacion()):
+        assert mapa_suelo.num_puntos.sum() == len(suelo), "Puntos del mapa de elevación incorrectos"
+    mapa_suelo = rejilla_suelo.mapa_elevacion()
+    assert np.allclose(mapa_suelo.altura_max[:, 0], [0.1, 1.2]), "Alturas máximas incorrectas"
+    transitabilidad = mapa_suelo.calcular_transitabilidad(max_escalon=0.3)
+    assert transitabilidad['transitable'].tolist() == [[False], [False]], "Escalón no detectado"
+    mapa_suelo.integrar_puntos([[-0.5, 0.5, 0.3]])
+    assert mapa_suelo.num_puntos.shape == (3, 1) and mapa_suelo.num_puntos[0, 0] == 1
+    print(f"✓ Mapa de elevación {mapa_suelo.num_puntos.shape} correcto")
+    
+    # Prueba almacenamiento cuantizado: error acotado y memoria menor
+    print("\nPrueba Almacenamiento Cuantizado:")
+    nube = np.random.RandomState(0).uniform(0, 1, size=(200, 3))
+    originales = np.vstack([nube, [[0.3, 0.2, 0.1]]])
+    for bits in (8, 16):
+        rejilla_q = RejillaOcupacion(tamaño_celda=0.5, bits_cuantizacion=bits)
+        rejilla_q.agregar_puntos_array(nube)
+        rejilla_q.agregar_puntos([PuntoNube(0.3, 0.2, 0.1, 10, 20, 30)])
+        octree_q = Octree(tamaño_minimo=0.5, bits_cuantizacion=bits)
+        octree_q.construir_octree([PuntoNube(*c) for c in nube])
+        for estructura in (rejilla_q, octree_q):
+            stats = estructura.obtener_estadisticas()
+            decodificadas = estructura.obtener_coordenadas()
+            error = IndiceVecinos(originales, 0.1).vecino_mas_cercano(decodificadas)[1].max()
+            assert error <= stats['error_cuantizacion_max'] * math.sqrt(3) + 1e-12, "Error de cuantización excesivo"
+            assert stats['ahorro_cuantizacion_bytes'] > 0, "La cuantización no ahorra memoria"
+    punto = rejilla_q.celdas[(0, 0, 0)].puntos[-1]
+    assert (punto.r, punto.g, punto.b) == (10, 20, 30) and abs(punto.x - 0.3) <= stats['error_cuantizacion_max']
+    print(f"✓ Cuantización correcta (error máximo por eje {rejilla_q.obtener_estadisticas()['error_cuantizacion_max']:.2e})")
+    
+    # Prueba ingesta por etapas: mismo resultado que la carga secuencial
+    print("\nPrueba Ingesta por Etapas:")
+    import tempfile
+    generador = np.random.RandomState(1)
+    # Cada archivo se desplaza para que el octree tenga que ampliar su raíz
+    nubes = [np.round(generador.uniform(0, 2, size=(300, 3)) + desplazamiento, 3)
+             for desplazamiento in ([0, 0, 0], [5, 0, 0], [-3, -4, 2])]
+    with tempfile.TemporaryDirectory() as directorio:
+        rutas = [os.path.join(directorio, f"nube{i}.pcd") for i in range(len(nubes))]
+        for ruta, nube in zip(rutas, nubes):
+            LectorPCD.escribir_archivo_pcd(ruta, nube)
+        rejilla_p = RejillaOcupacion(tamaño_celda=0.5)
+        metricas = PipelineIngesta(rejilla_p, num_lectores=2, capacidad_cola=1).ejecutar(rutas)
+        octree_p = Octree(tamaño_minimo=0.5)
+        PipelineIngesta(octree_p, num_lectores=2, capacidad_cola=1).ejecutar(rutas)
+        try:
+            PipelineIngesta(RejillaOcupacion()).ejecutar([rutas[0], os.path.join(directorio, "no_existe.pcd")])
+            assert False, "Un archivo inexistente no debe ingerirse como 0 puntos"
+        except RuntimeError:
+            pass
+        # La línea de comandos falla con código distinto de cero en lugar de usar 0 puntos
+        for comando in ('build', 'ingest'):
+            assert linea_comandos([comando, os.path.join(directorio, "no_existe.pcd")]) != 0
+    todas = np.vstack(nubes)
+    rejilla_s = RejillaOcupacion(tamaño_celda=0.5)
+    rejilla_s.agregar_puntos_array(todas)
+    assert metricas['archivos'] == 3 and metricas['puntos'] == len(todas)
+    assert rejilla_p.obtener_estadisticas() == rejilla_s.obtener_estadisticas(), "Rejilla distinta a la secuencial"
+    assert np.array_equal(rejilla_p.obtener_coordenadas(), rejilla_s.obtener_coordenadas())
+    assert octree_p.num_puntos_total == len(todas)
+    assert np.array_equal(np.unique(octree_p.obtener_coordenadas(), axis=0), np.unique(todas, axis=0)), \
+        "El octree perdió puntos al ampliar la raíz"
+    
+    # Contrapresión y orden: el primer archivo es el más lento de leer y el
+    # constructor no da abasto, así que los lectores terminan desordenados y bloqueados
+    eventos = {'pendientes': 0, 'max_pendientes': 0, 'orden': []}
+    cerrojo = threading.Lock()
+    
+    def lectura_lenta(ruta):
+        time.sleep(0.1 if ruta == 'nube0' else 0.01)
+        with cerrojo:
+            eventos['pendientes'] += 1
+            eventos['max_pendientes'] = max(eventos['max_pendientes'], eventos['pendientes'])
+        return np.full((10, 3), float(ruta[4:])), np.zeros((10, 3), dtype=np.int64)
+    
+    class RejillaLenta(RejillaOcupacion):
+        def agregar_puntos_array(self, coordenadas, colores=None, guardar_puntos=True):
+            time.sleep(0.03)
+            eventos['orden'].append(int(coordenadas[0, 0]))
+            super().agregar_puntos_array(coordenadas, colores, guardar_puntos)
+            with cerrojo:
+                eventos['pendientes'] -= 1
+    
+    metricas_lentas = PipelineIngesta(RejillaLenta(), num_lectores=3, capacidad_cola=1,
+                                      funcion_lectura=lectura_lenta).ejecutar([f"nube{i}" for i in range(8)])
+    assert eventos['orden'] == list(range(8)), "Los archivos no se integraron en orden"
+    assert metricas_lentas['lectura']['tiempo_espera'] > 0.05, "Los lectores no llegaron a bloquearse"
+    # Leídos sin integrar: uno en construcción, uno en la cola y uno por lector
+    assert eventos['max_pendientes'] <= 1 + 1 + 3, "La cola no limita la lectura adelantada"
+    print(f"✓ Ingesta correcta ({metricas['puntos']} puntos en {metricas['archivos']} archivos)")
+    
     print("✓ Todas las pruebas unitarias pasaron correctamente")
 
 
@@ -815,7 +2690,8 @@ DATA ascii
         pass
 
 
-if __name__ == "__main__":
+def ejecutar_demo():
+    """Ejecuta la demostración completa con datos sintéticos"""
     # Ejecutar programa principal
     main()
     
@@ -836,4 +2712,220 @@ if __name__ == "__main__":
     print("✓ Visualizador 3D (parte optativa)")
     print("✓ Pruebas unitarias")
     print("✓ Generación de gráficos y estadísticas")
-    print("\nEl código está listo para su uso y evaluación.")
\ No newline at end of file
+    print("\nEl código está listo para su uso y evaluación.")
+
+
+def _cargar_nube(ruta):
+    """
+    Lee un archivo PCD a arrays e informa del tiempo de lectura. Si no se
+    puede leer lanza RuntimeError con la ruta, que linea_comandos muestra
+    """
+    tiempo_inicio = time.perf_counter()
+    try:
+        coordenadas, colores = LectorPCD.leer_archivo_pcd_array(ruta, estricto=True)
+    except Exception as e:
+        raise RuntimeError(f"Error leyendo {ruta}: {e}") from e
+    print(f"{ruta}: {len(coordenadas)} puntos leídos en {time.perf_counter() - tiempo_inicio:.3f}s")
+    return coordenadas, colores
+
+
+def _construir_estructura(tipo, coordenadas, colores, tamaño, bits_cuantizacion=None):
+    """Construye una rejilla u octree a partir de arrays y devuelve (estructura, tiempo)"""
+    tiempo_inicio = time.perf_counter()
+    if tipo == 'rejilla':
+        estructura = RejillaOcupacion(tamaño, bits_cuantizacion)
+    else:
+        estructura = Octree(tamaño, bits_cuantizacion)
+    integrar_nube(estructura, coordenadas, colores)
+    return estructura, time.perf_counter() - tiempo_inicio
+
+
+def _tipos_estructura(args):
+    """Traduce la opción --estructura a la lista de estructuras a construir"""
+    return ['rejilla', 'octree'] if args.estructura == 'ambas' else [args.estructura]
+
+
+def _comando_build(args):
+    """Construye las estructuras para cada archivo e informa de los tiempos"""
+    for ruta in args.rutas:
+        coordenadas, colores = _cargar_nube(ruta)
+        for tipo in _tipos_estructura(args):
+            estructura, tiempo = _construir_estructura(tipo, coordenadas, colores, args.celda, args.bits)
+            print(f"  {tipo}: construida en {tiempo:.3f}s")
+    return 0
+
+
+def _comando_ingest(args):
+    """Integra todos los archivos en una misma estructura leyendo y construyendo por etapas"""
+    for tipo in _tipos_estructura(args):
+        estructura = RejillaOcupacion(args.celda, args.bits) if tipo == 'rejilla' else Octree(args.celda, args.bits)
+        print(f"\n{tipo.upper()}:")
+        if args.secuencial:
+            tiempo_inicio = time.perf_counter()
+            for ruta in args.rutas:
+                coordenadas, colores = _cargar_nube(ruta)
+                integrar_nube(estructura, coordenadas, colores)
+            print(f"  Tiempo total secuencial: {time.perf_counter() - tiempo_inicio:.3f}s")
+            continue
+        
+        pipeline = PipelineIngesta(estructura, args.lectores, args.cola, args.procesos)
+        metricas = pipeline.ejecutar(args.rutas, verbose=True)
+        print(f"  Tiempo total: {metricas['tiempo_total']:.3f}s "
+              f"(CPU de las etapas {metricas['tiempo_cpu_etapas']:.3f}s, "
+              f"mínimo con {metricas['nucleos']} núcleo(s) {metricas['tiempo_minimo']:.3f}s), "
+              f"{metricas['rendimiento_puntos_s']:.0f} puntos/s")
+        for etapa in ('lectura', 'construccion'):
+            datos = metricas[etapa]
+            print(f"  {etapa}: {datos['rendimiento_puntos_s']:.0f} puntos por segundo de CPU, "
+                  f"CPU {datos['tiempo_ocupado']:.3f}s, en espera {datos['tiempo_espera']:.3f}s")
+        print(f"  cola: profundidad máxima {metricas['cola']['profundidad_max']}/{metricas['cola']['capacidad']}, "
+              f"media {metricas['cola']['profundidad_media']:.2f}")
+    return 0
+
+
+def _comando_stats(args):
+    """Muestra las estadísticas de las estructuras para cada archivo"""
+    for ruta in args.rutas:
+        coordenadas, colores = _cargar_nube(ruta)
+        if len(coordenadas) > 0:
+            minimos = ", ".join(f"{v:.3f}" for v in coordenadas.min(axis=0))
+            maximos = ", ".join(f"{v:.3f}" for v in coordenadas.max(axis=0))
+            print(f"  Límites: min ({minimos}), max ({maximos})")
+        for tipo in _tipos_estructura(args):
+            estructura, tiempo = _construir_estructura(tipo, coordenadas, colores, args.celda, args.bits)
+            print(f"  {tipo.upper()} (construcción {tiempo:.3f}s):")
+            for nombre, valor in estructura.obtener_estadisticas().items():
+                print(f"    - {nombre}: {valor:.4f}" if isinstance(valor, float) else f"    - {nombre}: {valor}")
+    return 0
+
+
+def _comando_downsample(args):
+    """Sustituye los puntos de cada celda de la rejilla por su media"""
+    coordenadas, colores = _cargar_nube(args.entrada)
+    rejilla = RejillaOcupacion(args.celda)
+    rejilla.agregar_puntos_array(coordenadas, guardar_puntos=False)
+    medias = rejilla.medias_celdas()
+    LectorPCD.escribir_archivo_pcd(args.salida, medias)
+    print(f"{args.salida}: {len(medias)} puntos escritos "
+          f"({len(medias) / max(len(coordenadas), 1) * 100:.1f}% del original)")
+    return 0
+
+
+def medir_arranque(repeticiones=5):
+    """
+    Mide el tiempo de arranque en frío del módulo lanzando intérpretes nuevos
+    que solo lo importan. Devuelve los tiempos y si matplotlib llegó a cargarse
+    """
+    directorio, archivo = os.path.split(os.path.abspath(__file__))
+    codigo = f"import sys, {os.path.splitext(archivo)[0]}; print('matplotlib' in sys.modules)"
+    tiempos = []
+    carga_matplotlib = False
+    for _ in range(repeticiones):
+        tiempo_inicio = time.perf_counter()
+        salida = subprocess.run([sys.executable, '-c', codigo], cwd=directorio,
+                                capture_output=True, text=True, check=True)
+        tiempos.append(time.perf_counter() - tiempo_inicio)
+        carga_matplotlib |= salida.stdout.strip() == 'True'
+    return tiempos, carga_matplotlib
+
+
+def _comando_bench(args):
+    """Compara ambas estructuras sobre los archivos con varios tamaños de celda"""
+    if args.arranque:
+        tiempos, carga_matplotlib = medir_arranque()
+        print(f"Arranque en frío: mínimo {min(tiempos):.3f}s, "
+              f"mediana {sorted(tiempos)[len(tiempos) // 2]:.3f}s, "
+              f"matplotlib cargado: {'sí' if carga_matplotlib else 'no'}")
+    
+    for ruta in args.rutas:
+        coordenadas, colores = _cargar_nube(ruta)
+        puntos = [PuntoNube(x, y, z, r, g, b) for (x, y, z), (r, g, b)
+                  in zip(coordenadas.tolist(), colores.tolist())]
+        analizador = AnalizadorComparativo()
+        analizador.comparar_metodos(puntos, args.celdas)
+        analizador.generar_informe()
+        if args.graficos:
+            analizador.generar_graficos()
+    return 0
+
+
+def _comando_visualize(args):
+    """Dibuja los nodos ocupados del octree de un archivo"""
+    coordenadas, colores = _cargar_nube(args.ruta)
+    octree, tiempo = _construir_estructura('octree', coordenadas, colores, args.celda)
+    print(f"Octree construido en {tiempo:.3f}s")
+    VisualizadorOctree(octree).visualizar_nodos(max_nodos=args.max_nodos)
+    return 0
+
+
+def crear_parser():
+    """Define la interfaz de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Rejillas de ocupación y Octrees sobre archivos PCD")
+    subcomandos = parser.add_subparsers(dest='comando')
+    
+    def agregar_comunes(subparser):
+        subparser.add_argument('rutas', nargs='+', help="Archivos PCD")
+        subparser.add_argument('--celda', type=float, default=1.0,
+                               help="Tamaño de celda / tamaño mínimo de nodo (por defecto 1.0)")
+        subparser.add_argument('--estructura', choices=['rejilla', 'octree', 'ambas'], default='ambas')
+        subparser.add_argument('--bits', type=int, choices=[8, 16], default=None,
+                               help="Guarda los puntos cuantizados con 8 o 16 bits por eje")
+    
+    build = subcomandos.add_parser('build', help="Construye las estructuras y mide el tiempo")
+    agregar_comunes(build)
+    build.set_defaults(funcion=_comando_build)
+    
+    ingest = subcomandos.add_parser('ingest', help="Integra varios archivos en una estructura leyendo por etapas")
+    agregar_comunes(ingest)
+    ingest.add_argument('--lectores', type=int, default=2, help="Hilos lectores (por defecto 2)")
+    ingest.add_argument('--cola', type=int, default=2, help="Capacidad de la cola entre etapas (por defecto 2)")
+    ingest.add_argument('--procesos', action='store_true', help="Analiza los archivos en procesos aparte")
+    ingest.add_argument('--secuencial', action='store_true', help="Lee y construye uno tras otro, para comparar")
+    ingest.set_defaults(funcion=_comando_ingest)
+    
+    stats = subcomandos.add_parser('stats', help="Muestra las estadísticas de las estructuras")
+    agregar_comunes(stats)
+    stats.set_defaults(funcion=_comando_stats)
+    
+    downsample = subcomandos.add_parser('downsample', help="Submuestrea una nube con la media de cada celda")
+    downsample.add_argument('entrada', help="Archivo PCD de entrada")
+    downsample.add_argument('salida', help="Archivo PCD de salida")
+    downsample.add_argument('--celda', type=float, default=0.1, help="Tamaño de celda (por defecto 0.1)")
+    downsample.set_defaults(funcion=_comando_downsample)
+    
+    bench = subcomandos.add_parser('bench', help="Análisis comparativo con varios tamaños de celda")
+    bench.add_argument('rutas', nargs='*', help="Archivos PCD")
+    bench.add_argument('--celdas', type=float, nargs='+', default=[0.5, 1.0, 2.0, 4.0, 8.0])
+    bench.add_argument('--graficos', action='store_true', help="Muestra los gráficos comparativos")
+    bench.add_argument('--arranque', action='store_true', help="Mide el tiempo de arranque en frío")
+    bench.set_defaults(funcion=_comando_bench)
+    
+    visualize = subcomandos.add_parser('visualize', help="Visualiza el octree de un archivo")
+    visualize.add_argument('ruta', help="Archivo PCD")
+    visualize.add_argument('--celda', type=float, default=2.0, help="Tamaño mínimo de nodo (por defecto 2.0)")
+    visualize.add_argument('--max-nodos', type=int, default=1000)
+    visualize.set_defaults(funcion=_comando_visualize)
+    
+    demo = subcomandos.add_parser('demo', help="Demostración con datos sintéticos y pruebas unitarias")
+    demo.set_defaults(funcion=lambda args: ejecutar_demo() or 0)
+    
+    return parser
+
+
+def linea_comandos(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+    if args.comando is None:
+        parser.print_help()
+        return 1
+    try:
+        return args.funcion(args)
+    except RuntimeError as e:
+        # Archivos que no se pueden leer: un mensaje y código de salida distinto de cero
+        print(e, file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(linea_comandos())